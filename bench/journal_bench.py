@@ -0,0 +1,349 @@
+"""Benchmarks del journal con datos sintéticos y un stub local de la tabla Trades.
+
+Mide cómo escala cada etapa del camino caliente con el tamaño del journal
+(de 1k a 10M legs) sin tocar Supabase:
+
+    parse        parse_trades_frame sobre las celdas `trade`
+    parse_cell   parse_trades_cell fila a fila (solo hasta --rowwise-max)
+    load         _fetch_all_rows (paginado keyset contra el stub) + _trades_frame;
+                 única etapa que arranca journal.py, el resto usa journal_core
+    normalize    _normalize_pts
+    normalize_rowwise  _safe_pts con apply (solo hasta --rowwise-max)
+    metrics      compute_metrics
+    month_slice  month_filter del mes con más trades
+    render       daily_summary + calendar_html de ese mes
+    heatmap      daily_totals + heatmap_frame del histórico completo
+
+Uso (desde la raíz del repo):
+
+    python bench/journal_bench.py --sizes 1000,10000,100000
+    python bench/journal_bench.py --sizes 10000000 --skip load
+    python bench/journal_bench.py --compare bench/baseline.jsonl
+
+Cada medición se añade como una línea JSON a --out (por defecto bench/results.jsonl)
+con el commit, las versiones y los segundos (mejor de --repeat).
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timezone
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+
+ROOT = Path(__file__).resolve().parent.parent
+JOURNAL = ROOT / "journal.py"
+sys.path.insert(0, str(ROOT))
+import journal_core as core  # noqa: E402
+USER_ID = "bench-user"
+SYMBOLS = np.array(["NQ", "ES", "YM", "RTY", "CL", "GC", None], dtype=object)
+DAYS = np.array(["Lunes", "Martes", "Miércoles", "Jueves", "Viernes", "Sábado", "Domingo"], dtype=object)
+STAGES = ["parse", "parse_cell", "load", "normalize", "normalize_rowwise", "metrics", "month_slice", "render", "heatmap"]
+
+
+# =========================
+# 🧪 Datos sintéticos
+# =========================
+
+def generate_trades(n_legs: int, seed: int = 0) -> pd.DataFrame:
+    """`n_legs` filas con la forma de public."Trades": trades de 1 a 3 legs,
+    símbolos mezclados (y sin símbolo), BE, puntos como texto con '%' y nulos."""
+    rng = np.random.default_rng(seed)
+    legs_per_trade = rng.choice([1, 2, 3], size=n_legs, p=[0.6, 0.3, 0.1])
+    trade_id = np.repeat(np.arange(n_legs), legs_per_trade)[:n_legs]
+    n_trades = int(trade_id[-1]) + 1
+    leg = pd.Series(trade_id).groupby(trade_id).cumcount().to_numpy()
+
+    # ~40 legs por día; entre 1 y 15 años de histórico
+    days = int(np.clip(n_legs // 40, 365, 15 * 365))
+    start = np.datetime64("2015-01-01", "D")
+    trade_day = np.sort(rng.integers(0, days, size=n_trades))
+    fecha = start + trade_day[trade_id]
+
+    symbol = SYMBOLS[rng.integers(0, len(SYMBOLS), size=n_legs)]
+    signed = rng.integers(-40, 60, size=n_legs)
+    be = rng.random(n_legs) < 0.08
+    signed[be] = 0
+    point = signed.astype(object)
+    kind = rng.random(n_legs)
+    pct = (kind < 0.05) & ~be
+    point[pct] = np.char.add(signed[pct].astype(str), "%")      # '12%' (texto mixto)
+    point[(kind >= 0.05) & (kind < 0.07)] = None                 # nulos
+    point[(kind >= 0.07) & (kind < 0.08)] = np.nan               # NaN
+
+    # Texto de cada leg y celda `trade` completa (legs unidos por " ~ ", como el formulario), sin groupby por fila
+    body = np.where(be, "BE", np.char.add(np.char.add(np.where(signed >= 0, "+", ""), signed.astype(str)), "P"))
+    leg_txt = np.where(pd.isna(symbol), body, np.char.add(np.char.add(symbol.astype(str), ":"), body)).astype(object)
+    first = np.flatnonzero(leg == 0)[trade_id]
+    size = np.bincount(trade_id)[trade_id]
+    trade_txt = leg_txt[first]
+    for k in (1, 2):
+        nxt = leg_txt[np.minimum(first + k, n_legs - 1)]
+        trade_txt = np.where(size > k, trade_txt + " ~ " + nxt, trade_txt)
+
+    created = fecha.astype("datetime64[s]") + (np.arange(n_legs) % 86_400)
+    weekday = (fecha.astype("int64") + 3) % 7  # 1970-01-01 fue jueves
+    return pd.DataFrame({
+        "id": np.arange(1, n_legs + 1),
+        "User_id": USER_ID,
+        "fecha": np.datetime_as_string(fecha),
+        "semana": "Semana " + pd.Series(fecha).dt.isocalendar().week.astype(str).to_numpy(),
+        "dia": DAYS[weekday],
+        "symbol": symbol,
+        "point": point,
+        "be": be,
+        "trade": trade_txt,
+        "leg": leg,
+        "created_at": np.char.add(np.datetime_as_string(created), "+00:00"),
+    })
+
+
+# =========================
+# 🗄️ Stub de la API de tablas de Supabase (en proceso)
+# =========================
+
+class StubTable:
+    """Sustituto en memoria de `_table(name, user_id)`. Implementa lo que usa el DAO:
+    select/eq/in_/gte/lt/or_ (cursor keyset)/order/limit/execute, con índices ordenados
+    por (fecha, id) y (created_at, id) para que cada página cueste O(log n + página).
+    Como PostgREST, ninguna respuesta pasa de `max_rows` filas aunque no haya limit."""
+
+    def __init__(self, rows: list[dict], max_rows: int = 1000):
+        self.rows = rows
+        self.max_rows = max_rows
+        self.index = {}
+        for col in ("fecha", "created_at"):
+            order = sorted(range(len(rows)), key=lambda i: (rows[i][col], rows[i]["id"]))
+            self.index[col] = ([(rows[i][col], rows[i]["id"]) for i in order], order)
+        self.requests = 0
+
+    def __call__(self, name: str, user_id: str):
+        if name != "Trades":
+            raise NotImplementedError(name)  # las vistas no existen: la app usa el groupby local
+        return _StubQuery(self)
+
+
+class _StubQuery:
+    def __init__(self, table: StubTable):
+        self.t = table
+        self.lo = self.hi = self.after = self.symbols = None
+        self.order_col, self.desc, self.n = None, False, None
+
+    def select(self, cols):
+        return self
+
+    def eq(self, col, val):
+        if col != "User_id":
+            raise NotImplementedError(col)
+        return self
+
+    def in_(self, col, values):
+        self.symbols = set(values)
+        return self
+
+    def gte(self, col, val):
+        self.lo = val
+        return self
+
+    def lt(self, col, val):
+        self.hi = val
+        return self
+
+    def or_(self, expr):
+        # '{col}.gt."{val}",and({col}.eq."{val}",id.gt.{id})'
+        val = expr.split(".gt.", 1)[1].split(",", 1)[0].strip('"')
+        self.after = (val, int(expr.rsplit("id.gt.", 1)[1].rstrip(")")))
+        return self
+
+    def order(self, col, desc=False):
+        if self.order_col is None:
+            self.order_col, self.desc = col, desc
+        return self
+
+    def limit(self, n):
+        self.n = n
+        return self
+
+    def execute(self):
+        keys, order = self.t.index[self.order_col]
+        start = bisect_left(keys, (self.lo,)) if self.lo is not None else 0
+        if self.after is not None:
+            start = max(start, bisect_right(keys, self.after))
+        end = bisect_left(keys, (self.hi,)) if self.hi is not None else len(keys)
+        idx = range(end - 1, start - 1, -1) if self.desc else range(start, end)
+        cap = self.t.max_rows if self.n is None else min(self.n, self.t.max_rows)
+        out = []
+        for i in idx:
+            row = self.t.rows[order[i]]
+            if self.symbols is None or row["symbol"] in self.symbols:
+                out.append(row)
+                if len(out) >= cap:
+                    break
+        self.t.requests += 1
+        return SimpleNamespace(data=out)
+
+
+# =========================
+# 📦 Carga de journal.py sin servidor
+# =========================
+
+def load_journal(workdir: Path) -> dict:
+    """Ejecuta journal.py en modo "bare" de Streamlit (sin `streamlit run`) con secrets
+    de prueba en `workdir`; devuelve sus globales. La caché en disco queda en `workdir`."""
+    secrets = workdir / ".streamlit" / "secrets.toml"
+    secrets.parent.mkdir(parents=True, exist_ok=True)
+    secrets.write_text(
+        'SUPABASE_URL = "http://127.0.0.1:9"\n'
+        'SUPABASE_ANON_KEY = "bench.anon.key"\n'  # con forma de JWT: create_client la valida
+        'TRADES_AGGREGATES = "client"\n'
+    )
+    os.chdir(workdir)
+    # Sin los avisos "missing ScriptRunContext" del modo bare (antes y después de leer la config)
+    (workdir / ".streamlit" / "config.toml").write_text('[logger]\nlevel = "error"\n')
+    from streamlit.logger import set_log_level
+    set_log_level("error")
+    g = {"__name__": "journal_bench_app", "__file__": str(JOURNAL)}
+    exec(compile(JOURNAL.read_text(encoding="utf-8"), str(JOURNAL), "exec"), g)
+    return g
+
+
+# =========================
+# ⏱️ Medición
+# =========================
+
+def _best(fn, repeat: int) -> tuple[float, object]:
+    best, out = float("inf"), None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - t0)
+    return best, out
+
+
+def run_size(j: dict | None, n: int, stages: list[str], repeat: int, rowwise_max: int, seed: int) -> list[dict]:
+    raw = generate_trades(n, seed)
+    cells = pd.Series(raw.loc[raw["leg"] == 0, "trade"].to_numpy())
+    results = []
+
+    def record(stage, fn, rows):
+        seconds, out = _best(fn, repeat)
+        results.append({"stage": stage, "legs": n, "rows": rows, "seconds": round(seconds, 6)})
+        print(f"{n:>10,} legs  {stage:<18} {seconds * 1000:10.1f} ms", flush=True)
+        return out
+
+    if "parse" in stages:
+        record("parse", lambda: core.parse_trades_frame(cells), len(cells))
+    if "parse_cell" in stages and len(cells) <= rowwise_max:
+        record("parse_cell", lambda: [core.parse_trades_cell(c) for c in cells], len(cells))
+
+    rows = raw.drop(columns="leg").astype(object).where(raw.notna(), None).to_dict("records")
+    if "load" in stages:
+        stub = StubTable(rows)
+        j["_table"] = stub
+        df = record("load", lambda: core._trades_frame(j["_fetch_all_rows"](USER_ID)), n)
+        # Fuera del tiempo medido: tamaño JSON aproximado de lo que devolvería PostgREST
+        results[-1].update(requests=stub.requests // repeat, payload_bytes=len(json.dumps(rows, default=str)))
+    else:
+        df = core._trades_frame(rows)
+    del rows
+
+    if "normalize" in stages:
+        record("normalize", lambda: core._normalize_pts(df, "point"), n)
+    if "normalize_rowwise" in stages and n <= rowwise_max:
+        record("normalize_rowwise", lambda: df.apply(core._safe_pts, axis=1), n)
+    if "metrics" in stages:
+        record("metrics", lambda: core.compute_metrics(df), n)
+
+    busiest = df["fecha_dt"].dt.to_period("M").value_counts().idxmax()
+    year, month = busiest.year, busiest.month
+    if "month_slice" in stages:
+        record("month_slice", lambda: core.month_filter(df, year, month), n)
+    if "render" in stages:
+        df_m = core.month_filter(df, year, month)
+
+        def render():
+            daily = core.daily_summary(df_m).groupby("day").agg(pts=("pts", "sum"), trades=("trades", "sum"))
+            return core.calendar_html(year, month, daily["pts"].to_dict(), daily["trades"].to_dict())
+        record("render", render, len(df_m))
+    if "heatmap" in stages:
+        record("heatmap", lambda: core.heatmap_frame(core.daily_totals(df)), n)
+    return results
+
+
+def _run_info() -> dict:
+    try:
+        commit = subprocess.run(["git", "-C", str(ROOT), "rev-parse", "--short", "HEAD"],
+                                capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        commit = None
+    return {
+        "run_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+    }
+
+
+def compare(base_path: Path, current: list[dict]):
+    """Ratio actual/base por (stage, legs) usando la última medición de cada clave en la base."""
+    base = {}
+    for line in base_path.read_text().splitlines():
+        r = json.loads(line)
+        base[(r["stage"], r["legs"])] = r["seconds"]
+    print(f"\n{'stage':<18} {'legs':>10} {'base ms':>10} {'ahora ms':>10} {'ratio':>7}")
+    for r in current:
+        b = base.get((r["stage"], r["legs"]))
+        if b:
+            ratio = r["seconds"] / b if b else float("nan")
+            flag = "  ⚠️" if ratio > 1.2 else ""
+            print(f"{r['stage']:<18} {r['legs']:>10,} {b * 1000:>10.1f} {r['seconds'] * 1000:>10.1f} {ratio:>7.2f}{flag}")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--sizes", default="1000,10000,100000,1000000",
+                    help="legs por ejecución, separados por comas (hasta 10000000)")
+    ap.add_argument("--stages", default=",".join(STAGES))
+    ap.add_argument("--skip", default="", help="etapas a omitir (p.ej. load para 10M)")
+    ap.add_argument("--repeat", type=int, default=3, help="se guarda el mejor tiempo")
+    ap.add_argument("--rowwise-max", type=int, default=100_000,
+                    help="tamaño máximo para las etapas fila a fila")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--out", default=str(ROOT / "bench" / "results.jsonl"))
+    ap.add_argument("--compare", help="jsonl de una ejecución anterior")
+    args = ap.parse_args(argv)
+
+    skip = set(filter(None, args.skip.split(",")))
+    stages = [s for s in args.stages.split(",") if s and s not in skip]
+    sizes = [int(s) for s in args.sizes.split(",") if s]
+    out = Path(args.out).resolve()
+    base = Path(args.compare).resolve() if args.compare else None
+
+    with tempfile.TemporaryDirectory(prefix="journal-bench-") as tmp:
+        j = load_journal(Path(tmp)) if "load" in stages else None
+        info = _run_info()
+        results = []
+        for n in sizes:
+            results += run_size(j, n, stages, args.repeat, args.rowwise_max, args.seed)
+
+    out.parent.mkdir(parents=True, exist_ok=True)
+    with out.open("a") as f:
+        for r in results:
+            f.write(json.dumps({**info, **r}) + "\n")
+    print(f"\n{len(results)} mediciones → {out}")
+    if base:
+        compare(base, results)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,13 +2,43 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 import altair as alt
-from datetime import datetime, date
-import calendar
+import pyarrow as pa
+import pyarrow.parquet as pq
+from datetime import datetime, date, timedelta, timezone
 import re
+import os
+import time
+import hashlib
+import uuid
+import tempfile
+import jwt
+from types import SimpleNamespace
+import json
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+import multiprocessing
+from itertools import chain, count
+from collections import OrderedDict
 
 st.set_page_config(page_title="Trading Journal Pro — Supabase", layout="wide")
 
-from supabase import create_client
+from supabase import create_client, ClientOptions
+import httpx
+from postgrest import SyncPostgrestClient
+from postgrest._sync.request_builder import SyncRequestBuilder
+from postgrest.utils import SyncClient
+from postgrest.exceptions import APIError
+
+# Lógica sin Streamlit (parsing, histórico, resúmenes, calendario, métricas); ver journal_core.py
+from journal_core import (
+    ES_DAYS, MONTHS_ES, TRADE_COLUMNS, TRADE_SELECT, SUMMARY_COLUMNS, ROLLING_METRICS, MC_PERCENTILES,
+    parse_trades_cell, _trades_frame, _compact_frame, read_journal_file, build_import_rows,
+    month_filter, daily_summary, monthly_summary, filter_symbols, calendar_html, CALENDAR_CSS,
+    WEEKDAYS_SHORT, daily_totals, heatmap_frame,
+    _metrics_build, _metrics_fold, _metrics_result, compute_breakdown, rolling_metrics,
+    streak_metrics, simulate_paths,
+)
 
 
 
@@ -22,7 +52,78 @@ if not SUPABASE_URL or not SUPABASE_KEY:
     st.error("Faltan SUPABASE_URL y/o SUPABASE_ANON_KEY en st.secrets")
     st.stop()
 
-supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+# Pool HTTP del proceso: conexiones keep-alive compartidas por todas las sesiones
+HTTP_MAX_CONNECTIONS = int(st.secrets.get("HTTP_MAX_CONNECTIONS", 20))
+HTTP_KEEPALIVE = 60  # segundos que una conexión ociosa sigue abierta
+# Sin conexión se reintenta en cada rerun: un Supabase colgado no debe bloquear el script 120 s (default de postgrest)
+HTTP_TIMEOUT = float(st.secrets.get("HTTP_TIMEOUT", 15))
+HTTP_CONNECT_TIMEOUT = float(st.secrets.get("HTTP_CONNECT_TIMEOUT", 3))
+
+
+class _PooledPostgrest(SyncPostgrestClient):
+    """Cliente PostgREST con límite de conexiones, keep-alive y timeouts configurables."""
+
+    def create_session(self, base_url, headers, timeout, verify=True):
+        return SyncClient(
+            base_url=base_url, headers=headers, verify=verify,
+            timeout=httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+            follow_redirects=True, http2=True,
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_CONNECTIONS,
+                keepalive_expiry=HTTP_KEEPALIVE,
+            ),
+        )
+
+
+class _AuthSession:
+    """Vista de la sesión compartida que añade el JWT del usuario a cada petición
+    (sin tocar las cabeceras globales: sesiones concurrentes no se pisan)."""
+
+    def __init__(self, session, token: str | None):
+        self._session, self._token = session, token
+
+    def request(self, method, url, headers=None, **kwargs):
+        headers = dict(headers or {})
+        if self._token:
+            headers["Authorization"] = f"Bearer {self._token}"
+        return self._session.request(method, url, headers=headers, **kwargs)
+
+
+@st.cache_resource(show_spinner=False)
+def _supabase_client():
+    """Cliente de Auth del proceso: sin sesión persistida ni auto-refresh (es compartido)."""
+    return create_client(
+        SUPABASE_URL, SUPABASE_KEY,
+        options=ClientOptions(auto_refresh_token=False, persist_session=False),
+    )
+
+
+@st.cache_resource(show_spinner=False)
+def _rest_client() -> _PooledPostgrest:
+    return _PooledPostgrest(
+        f"{SUPABASE_URL}/rest/v1",
+        headers={"apikey": SUPABASE_KEY, "Authorization": f"Bearer {SUPABASE_KEY}"},
+    )
+
+
+@st.cache_resource(show_spinner=False)
+def _session_tokens() -> dict:
+    """user_id → access_token vigente; lo leen también los hilos de paginado e importación."""
+    return {}
+
+
+def bind_session(user_id: str, token: str | None):
+    if token:
+        _session_tokens()[user_id] = token
+
+
+def _table(name: str, user_id: str) -> SyncRequestBuilder:
+    """Builder de `name` con la auth del usuario en cada petición (RLS)."""
+    return SyncRequestBuilder(_AuthSession(_rest_client().session, _session_tokens().get(user_id)), f"/{name}")
+
+
+supabase = _supabase_client()
 
 # =========================
 # 🎨 Estilos mínimos
@@ -42,6 +143,7 @@ st.markdown(
     """,
     unsafe_allow_html=True,
 )
+st.markdown(CALENDAR_CSS, unsafe_allow_html=True)  # una vez por página; los calendarios van sin <style>
 
 # =========================
 # 🔐 Sesión / Auth helpers
@@ -49,35 +151,14 @@ st.markdown(
 if "auth" not in st.session_state:
     st.session_state.auth = {"user": None, "access_token": None}
 
-def _safe_pts(row, colname="point"):
-    """Devuelve puntos/porcentaje como float.
-    Soporta None, '', 'nan', '2.5', '2.5%', etc. y respeta BE."""
-    if bool(row.get("be", False)):
-        return 0.0
-    v = row.get(colname, 0)
-    if v is None:
-        return 0.0
-    if isinstance(v, str):
-        v = v.strip()
-        if v.endswith("%"):
-            v = v[:-1]  # quita el símbolo
-        if v == "" or v.lower() in {"nan", "none"}:
-            return 0.0
-    try:
-        return float(v)
-    except Exception:
-        return 0.0
-
-
 def do_sign_in(email: str, password: str):
     try:
         res = supabase.auth.sign_in_with_password({"email": email, "password": password})
         if res.user and res.session:
             token = res.session.access_token
-            # Aplica el token al cliente PostgREST (para que las queries tengan RLS)
-            supabase.postgrest.auth(token)
             # Guarda la sesión en Streamlit
             st.session_state.auth = {"user": res.user, "access_token": token}
+            _remember_token(token, _token_claims(token))
             # Guarda el token localmente en la URL (persiste tras refresh)
             st.experimental_set_query_params(token=token)
             return True, None
@@ -88,82 +169,407 @@ def do_sign_in(email: str, password: str):
 
 
 
+# Validación local del JWT: get_user solo al estrenar un token o cerca de su expiración
+JWT_SECRET = st.secrets.get("SUPABASE_JWT_SECRET", "")  # Settings → API → JWT Secret (HS256)
+AUTH_REFRESH_MARGIN = 120  # segundos antes de exp en los que se vuelve a validar contra el servidor
+
+
+def _token_claims(token: str) -> dict | None:
+    """Claims del JWT. Con JWT_SECRET se verifican firma y expiración localmente;
+    sin él solo se lee exp (la firma la valida get_user la primera vez)."""
+    try:
+        if JWT_SECRET:
+            return jwt.decode(token, JWT_SECRET, algorithms=["HS256"], audience="authenticated")
+        return jwt.decode(token, options={"verify_signature": False, "verify_exp": True})
+    except jwt.PyJWTError:
+        return None
+
+
+def _remember_token(token: str, claims: dict | None):
+    """Caché de sesión: este token ya está validado hasta su exp."""
+    st.session_state.auth_checked = {"token": token, "exp": (claims or {}).get("exp", 0)}
+
+
+def restore_session(token: str):
+    """Restaura la sesión desde el token de la URL sin ir al servidor en cada rerun."""
+    claims = _token_claims(token)
+    fresh = claims is not None and claims.get("exp", 0) - time.time() > AUTH_REFRESH_MARGIN
+    checked = st.session_state.get("auth_checked") or {}
+    if fresh and checked.get("token") == token and st.session_state.auth.get("user"):
+        return  # validado en esta sesión y lejos de expirar
+    if fresh and JWT_SECRET:
+        # Firma verificada localmente: el usuario sale de los claims
+        user = SimpleNamespace(id=claims["sub"], email=claims.get("email"))
+        st.session_state.auth = {"user": user, "access_token": token}
+        _remember_token(token, claims)
+        return
+    try:
+        res = supabase.auth.get_user(token)
+    except Exception:
+        res = None
+    if res and res.user:
+        st.session_state.auth = {"user": res.user, "access_token": token}
+        _remember_token(token, claims)
+    else:
+        st.session_state.auth = {"user": None, "access_token": None}
+        st.session_state.auth_checked = None
+        st.experimental_set_query_params()  # token vencido o inválido: vuelve al login
+
+
 def do_sign_up(email: str, password: str):
     try:
-        res = supabase.auth.sign_up({"email": email, "password": password})
-        # Si tu proyecto no requiere confirmación, puede devolver sesión inmediata
-        if getattr(res, "session", None) and res.session.access_token:
-            supabase.postgrest.auth(res.session.access_token)
+        supabase.auth.sign_up({"email": email, "password": password})
         return True, None
     except Exception as e:
         return False, str(e)
 
 
 def do_sign_out():
+    token = st.session_state.auth.get("access_token")
     try:
-        supabase.auth.sign_out()
+        if token:
+            # Revoca solo el token de esta sesión; el cliente de Auth es compartido
+            supabase.auth.admin.sign_out(token, scope="local")
     except Exception:
         pass
+    user = st.session_state.auth.get("user")
+    if user and _session_tokens().get(user.id) == token:
+        _session_tokens().pop(user.id, None)
     st.session_state.auth = {"user": None, "access_token": None}
+    st.session_state.auth_checked = None
     st.experimental_set_query_params()  # Limpia token en URL
     st.rerun()
 
 
 # =========================
-# 🧩 Parsing de trades
-# Soporta: "NQ:+50P", "ES:-20P", "BE", "+30P", "-10P" y múltiples con '~'
+# 🗄️ DAO — Acceso a datos (solo public."Trades")
 # =========================
-TRADE_PATTERN = re.compile(r"^(?:(?P<sym>[A-Za-z0-9_]+):)?(?P<body>(?P<signed>[+-]?\d+)P|BE)$")
-ES_DAYS = {0:"Lunes",1:"Martes",2:"Miércoles",3:"Jueves",4:"Viernes",5:"Sábado",6:"Domingo"}
-MONTHS_ES = ["Enero","Febrero","Marzo","Abril","Mayo","Junio","Julio","Agosto","Septiembre","Octubre","Noviembre","Diciembre"]
-
-
-def parse_trades_cell(cell: str):
-    if cell is None:
-        return []
-    items = [s.strip() for s in str(cell).split("~") if str(s).strip()]
-    parsed = []
-    for it in items:
-        m = TRADE_PATTERN.match(it)
-        if not m:
-            if it in {"None","nan","error","-error",""}:
-                continue
-            parsed.append({"symbol": None, "porcentaje": 0, "is_be": False, "raw": it})
-            continue
-        sym = m.group("sym")
-        body = m.group("body")
-        if body == "BE":
-            parsed.append({"symbol": sym, "porcentaje": 0, "is_be": True, "raw": it})
-        else:
-            pts = int(m.group("signed"))
-            parsed.append({"symbol": sym, "porcentaje": pts, "is_be": False, "raw": it})
-    return parsed
+FULL_RECONCILE_EVERY = timedelta(minutes=30)  # recarga completa periódica (ediciones/borrados)
+TRADES_POLL_EVERY = timedelta(seconds=int(st.secrets.get("TRADES_POLL_SECONDS", 60)))  # delta de escrituras externas
+OFFLINE_RETRY_EVERY = timedelta(seconds=5)  # sin conexión se reintenta antes que el sondeo normal
+PAGE_SIZE = 1000   # filas por página; no debe superar el max-rows de PostgREST (1000 en Supabase)
+PAGE_WORKERS = 4   # páginas pedidas en paralelo como máximo
+# Límites de memoria entre usuarios (LRU)
+SNAPSHOT_MAX_USERS = int(st.secrets.get("SNAPSHOT_MAX_USERS", 64))
+SNAPSHOT_MAX_ROWS = int(st.secrets.get("SNAPSHOT_MAX_ROWS", 2_000_000))
+CACHE_MAX_ENTRIES = int(st.secrets.get("CACHE_MAX_ENTRIES", 256))  # por función cacheada
+
+
+def _watermark(df: pd.DataFrame):
+    """Marca de agua (created_at, id) de la fila más reciente del snapshot."""
+    if df.empty:
+        return None
+    ts = pd.to_datetime(df["created_at"], utc=True, errors="coerce", format="ISO8601")
+    last = df.assign(_ts=ts).sort_values(["_ts", "id"]).iloc[-1]
+    return last["_ts"].isoformat(), int(last["id"])
+
+
+def _select_trades(user_id: str, cols: str = TRADE_SELECT):
+    return (
+        _table("Trades", user_id)  # comillas porque la tabla tiene T mayúscula
+        .select(cols)
+        .eq("User_id", user_id)
+    )
+
+
+def _fetch_page(user_id: str, col: str, after=None, lo=None, hi=None, symbols=None) -> list[dict]:
+    """Una página ordenada por (col, id), con cursor keyset `after` = (valor, id),
+    límites opcionales lo <= col < hi y filtro opcional de símbolos."""
+    q = _select_trades(user_id)
+    if symbols:
+        q = q.in_("symbol", list(symbols))
+    if lo is not None:
+        q = q.gte(col, lo)
+    if hi is not None:
+        q = q.lt(col, hi)
+    if after is not None:
+        val, last_id = after
+        q = q.or_(f'{col}.gt."{val}",and({col}.eq."{val}",id.gt.{last_id})')
+    data = q.order(col, desc=False).order("id", desc=False).limit(PAGE_SIZE).execute()
+    return data.data if hasattr(data, "data") else []
+
+
+def _iter_pages(user_id: str, col: str, after=None, lo=None, hi=None, symbols=None):
+    """Genera por keyset las páginas de un rango, una a la vez."""
+    while True:
+        page = _fetch_page(user_id, col, after=after, lo=lo, hi=hi, symbols=symbols)
+        yield page
+        if len(page) < PAGE_SIZE:
+            return
+        after = (page[-1][col], page[-1]["id"])
+
+
+def _fetch_range(user_id: str, col: str, after=None, lo=None, hi=None) -> list[list[dict]]:
+    """Recorre por keyset todas las páginas de un rango; devuelve la lista de páginas."""
+    return list(_iter_pages(user_id, col, after=after, lo=lo, hi=hi))
+
+
+def _fetch_all_rows(user_id: str) -> list[dict]:
+    """Histórico completo ordenado por (fecha, id).
+    La primera página se pide sola; si hay más, el resto de fechas se parte en
+    PAGE_WORKERS tramos que se paginan en paralelo."""
+    first = _fetch_page(user_id, "fecha")
+    if len(first) < PAGE_SIZE:
+        return first
+    last = _select_trades(user_id, "fecha").order("fecha", desc=True).limit(1).execute()
+    start = date.fromisoformat(str(first[-1]["fecha"])[:10])
+    end = date.fromisoformat(str(last.data[0]["fecha"])[:10]) + timedelta(days=1)
+    step = max(1, -(-(end - start).days // PAGE_WORKERS))
+    bounds = [start + timedelta(days=i * step) for i in range(PAGE_WORKERS) if start + timedelta(days=i * step) < end]
+    ranges = []
+    for i, lo in enumerate(bounds):
+        hi = str(bounds[i + 1]) if i + 1 < len(bounds) else None  # el último tramo queda abierto
+        after = (first[-1]["fecha"], first[-1]["id"]) if i == 0 else None
+        ranges.append(dict(after=after, lo=str(lo), hi=hi))
+    with ThreadPoolExecutor(max_workers=PAGE_WORKERS) as pool:
+        results = list(pool.map(lambda r: _fetch_range(user_id, "fecha", **r), ranges))
+    # Una sola concatenación lineal de listas; el DataFrame se construye una vez
+    return list(chain(first, *(page for pages in results for page in pages)))
+
 
 # =========================
-# 🗄️ DAO — Acceso a datos (solo public."Trades")
+# 💾 Caché en disco (Arrow IPC) por usuario
+# Arranque en frío: se mapea el snapshot en memoria y solo se piden las filas nuevas.
 # =========================
-@st.cache_data(show_spinner=False)
-def fetch_trades(user_id: str) -> pd.DataFrame:
-    data = (
-        supabase
-        .table("Trades")  # comillas porque la tabla tiene T mayúscula
-        .select('id,"User_id",fecha,semana,dia,symbol,point,be,trade,created_at')
-        .eq("User_id", user_id)
-        .order("fecha", desc=False)
-        .execute()
+CACHE_DIR = Path(st.secrets.get("TRADES_CACHE_DIR", ".cache/trades"))
+CACHE_FORMAT = 3  # subir cuando cambien las columnas o tipos de _trades_frame
+
+
+def _cache_path(user_id: str) -> Path:
+    return CACHE_DIR / (re.sub(r"[^A-Za-z0-9_-]", "_", str(user_id)) + ".arrow")
+
+
+def _save_snapshot(user_id: str, snap: dict):
+    """Escribe el snapshot (sin comprimir, para poder mapearlo) de forma atómica."""
+    df = snap["df"]
+    for c in df.columns[df.dtypes == object]:
+        try:
+            pa.array(df[c], from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            df = df.assign(**{c: df[c].astype("string")})  # columnas mixtas (p.ej. point con '2.5%')
+    meta = {
+        "format": CACHE_FORMAT,
+        "watermark": snap["watermark"],
+        "reconciled_at": snap["reconciled_at"].isoformat(),
+    }
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), b"journal": json.dumps(meta).encode()})
+    path = _cache_path(user_id)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    with pa.OSFile(str(tmp), "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    os.replace(tmp, path)
+
+
+def _load_snapshot(user_id: str) -> dict | None:
+    path = _cache_path(user_id)
+    if not path.exists():
+        return None
+    try:
+        with pa.memory_map(str(path), "r") as source:
+            table = pa.ipc.open_file(source).read_all()
+            meta = json.loads(table.schema.metadata[b"journal"])
+            df = table.to_pandas()
+    except Exception:
+        return None  # caché corrupta: se recarga desde Supabase
+    if meta.get("format") != CACHE_FORMAT:
+        return None  # formato anterior: se recarga desde Supabase
+    wm = meta.get("watermark")
+    rec = meta.get("reconciled_at")
+    return {
+        "df": _compact_frame(df),
+        "watermark": tuple(wm) if wm else None,
+        # El snapshot de disco se pone al día por delta; la reconciliación sigue su ciclo desde la guardada
+        "reconciled_at": datetime.fromisoformat(rec) if rec else datetime.min,
+    }
+
+
+@st.cache_resource(show_spinner=False)
+def _trade_snapshots() -> dict:
+    """Snapshots por usuario compartidos por todas las sesiones del proceso (LRU).
+    También guarda la versión de datos de cada usuario, que forma parte de la clave
+    de los st.cache_data: escribir solo invalida las entradas de ese usuario."""
+    return {
+        "lock": threading.Lock(),
+        "users": OrderedDict(),   # user_id -> snapshot, del menos al más reciente
+        "user_locks": {},
+        "versions": {},
+        "force_full": set(),
+    }
+
+
+def _user_lock(store: dict, user_id: str) -> threading.Lock:
+    with store["lock"]:
+        return store["user_locks"].setdefault(user_id, threading.Lock())
+
+
+def _remember_snapshot(store: dict, user_id: str, snap: dict):
+    """Guarda el snapshot como el más reciente y expulsa los menos usados
+    mientras se superen SNAPSHOT_MAX_USERS o SNAPSHOT_MAX_ROWS (siguen en disco)."""
+    with store["lock"]:
+        users = store["users"]
+        users[user_id] = snap
+        users.move_to_end(user_id)
+        rows = sum(len(s["df"]) for s in users.values())
+        while len(users) > 1 and (len(users) > SNAPSHOT_MAX_USERS or rows > SNAPSHOT_MAX_ROWS):
+            _, old = users.popitem(last=False)
+            rows -= len(old["df"])
+
+
+def sync_trades(user_id: str, full: bool = False) -> pd.DataFrame:
+    """Devuelve el histórico del usuario usando su snapshot local (memoria o disco).
+    Solo descarga filas con (created_at, id) posterior a la marca de agua;
+    hace una recarga completa si se pide, si no hay snapshot o cada FULL_RECONCILE_EVERY.
+    Si Supabase no responde y hay snapshot, lo devuelve en modo solo lectura (offline).
+    Si un sondeo (sin escritura propia de por medio) trae cambios, sube la versión del usuario."""
+    store = _trade_snapshots()
+    with _user_lock(store, user_id):
+        with store["lock"]:
+            snap = store["users"].get(user_id)
+            full = full or user_id in store["force_full"]
+            version = store["versions"].get(user_id, 0)
+        polled = snap is not None and snap.get("version") == version
+        snap = snap or _load_snapshot(user_id)
+        now = datetime.now()
+        changed = False
+        try:
+            if full or snap is None or now - snap["reconciled_at"] >= FULL_RECONCILE_EVERY:
+                changed = True
+                df = _trades_frame(_fetch_all_rows(user_id))
+                snap = {"df": df, "watermark": _watermark(df), "reconciled_at": now, "metrics": _metrics_build(df)}
+                _save_snapshot(user_id, snap)
+            else:
+                pages = _fetch_range(user_id, "created_at", after=snap["watermark"])
+                new = _trades_frame(list(chain.from_iterable(pages)))
+                if not new.empty:
+                    changed = True
+                    old = snap["df"]
+                    df = new if old.empty else pd.concat([old, new], ignore_index=True)
+                    df = df.drop_duplicates("id", keep="last").sort_values("fecha_dt", kind="stable", ignore_index=True)
+                    df = _compact_frame(df)  # concat de categorías distintas vuelve a object
+                    snap = {**snap, "df": df, "watermark": _watermark(df), "metrics": _metrics_append(snap.get("metrics"), old, df)}
+                    _save_snapshot(user_id, snap)
+            with store["lock"]:
+                store["force_full"].discard(user_id)
+            snap["offline"] = False
+            if changed and polled:
+                bump_trades_version(user_id)  # invalida los agregados cacheados con la versión anterior
+                version += 1
+        except Exception:
+            if snap is None:
+                raise
+            snap["offline"] = True
+        snap["synced_at"] = now
+        snap["version"] = version  # la leída al empezar: una escritura concurrente fuerza otra sincronización
+        _remember_snapshot(store, user_id, snap)
+        return snap["df"]
+
+
+def _metrics_append(acc: dict | None, old: pd.DataFrame, df: pd.DataFrame) -> dict:
+    """Pliega solo las filas nuevas si quedaron al final del histórico (fechas >= la última);
+    un trade con fecha anterior cambia la curva en medio y obliga a reconstruir."""
+    tail = df.iloc[len(old):]
+    appended = (
+        acc is not None and acc["n"] == len(old)
+        and df["id"].iloc[:len(old)].equals(old["id"].reset_index(drop=True))
     )
-    rows = data.data if hasattr(data, "data") else []
-    df = pd.DataFrame(rows)
-    if df.empty:
-        return pd.DataFrame(columns=["id","User_id","fecha","semana","dia","symbol","point","be","trade","created_at"]) 
-    df["fecha"] = pd.to_datetime(df["fecha"], errors="coerce").dt.date
-    return df
+    return _metrics_fold(acc, tail) if appended else _metrics_build(df)
+
+
+def request_full_reconcile(user_id: str):
+    """Fuerza que la próxima sincronización del usuario sea una recarga completa."""
+    store = _trade_snapshots()
+    with store["lock"]:
+        store["force_full"].add(user_id)
+    bump_trades_version(user_id)
+
+
+def trades_version(user_id: str) -> int:
+    """Versión de datos del usuario; va en la clave de fetch_*/compute_metrics."""
+    return _trade_snapshots()["versions"].get(user_id, 0)
+
+
+def bump_trades_version(user_id: str):
+    """Invalida solo las entradas cacheadas de este usuario (las viejas salen por LRU)."""
+    store = _trade_snapshots()
+    with store["lock"]:
+        store["versions"][user_id] = store["versions"].get(user_id, 0) + 1
+
+
+def trades_offline(user_id: str) -> bool:
+    """True si la última sincronización no llegó a Supabase y se sirve la caché local."""
+    snap = _trade_snapshots()["users"].get(user_id)
+    return bool(snap and snap.get("offline"))
+
+
+def fetch_trades(user_id: str, version: int = 0) -> pd.DataFrame:
+    """Histórico del usuario servido desde su snapshot (store LRU, acotado por SNAPSHOT_MAX_*).
+    Sin st.cache_data: guardaría otra copia completa por versión. Sincroniza si el
+    snapshot es de una versión anterior, no está en memoria o pasó TRADES_POLL_EVERY
+    (así llegan las escrituras de otros dispositivos y la reconciliación periódica).
+    Una copia servida sin conexión caduca a los OFFLINE_RETRY_EVERY."""
+    store = _trade_snapshots()
+    with store["lock"]:
+        snap = store["users"].get(user_id)
+        if snap is not None:
+            store["users"].move_to_end(user_id)  # el LRU expulsa por último uso, no por última sincronización
+    ttl = OFFLINE_RETRY_EVERY if snap is not None and snap.get("offline") else TRADES_POLL_EVERY
+    if (snap is not None and snap.get("version", -1) >= version
+            and datetime.now() - snap["synced_at"] < ttl):
+        return snap["df"]
+    return sync_trades(user_id)
+
+
+# Agregados en servidor (vistas de sql/trades_aggregates.sql); "client" fuerza el groupby local
+SERVER_AGGREGATES = str(st.secrets.get("TRADES_AGGREGATES", "server")).lower() == "server"
+
+
+def _fetch_view(view: str, user_id: str, cols: str, order: list[str], lo: str | None = None, hi: str | None = None) -> list[dict]:
+    """Todas las filas de una vista de agregados, en páginas de PAGE_SIZE con .range():
+    sin paginar, PostgREST corta en max-rows. `order` es único por fila (no salta ni repite)."""
+    rows = []
+    while True:
+        q = _table(view, user_id).select(cols).eq("User_id", user_id)
+        if lo is not None:
+            q = q.gte("fecha", lo)
+        if hi is not None:
+            q = q.lt("fecha", hi)
+        for c in order:
+            q = q.order(c)
+        page = q.range(len(rows), len(rows) + PAGE_SIZE - 1).execute().data or []
+        rows += page
+        if len(page) < PAGE_SIZE:
+            return rows
+
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def fetch_daily_summary(user_id: str, year: int, month: int, version: int = 0) -> pd.DataFrame | None:
+    """(day, symbol, pts, trades) del mes desde la vista trades_daily.
+    None si la vista no existe o falla: las vistas usan el groupby local."""
+    first = date(year, month, 1)
+    nxt = date(year + (month == 12), month % 12 + 1, 1)
+    try:
+        rows = _fetch_view("trades_daily", user_id, "day,symbol,pts,trades", ["day", "symbol"], str(first), str(nxt))
+    except Exception:
+        return None
+    return pd.DataFrame(rows, columns=["day"] + SUMMARY_COLUMNS)
+
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def fetch_monthly_summary(user_id: str, version: int = 0) -> pd.DataFrame | None:
+    """(year, month, symbol, pts, trades) de todo el histórico desde la vista trades_monthly."""
+    try:
+        rows = _fetch_view("trades_monthly", user_id, "year,month,symbol,pts,trades", ["year", "month", "symbol"])
+    except Exception:
+        return None
+    return pd.DataFrame(rows, columns=["year", "month"] + SUMMARY_COLUMNS)
 
 
-def insert_trade_entries(user_id: str, fecha_val: date, semana_txt: str, dia_txt: str, trade_text: str):
-    parsed = parse_trades_cell(trade_text)
+def _entry_rows(user_id: str, fecha_val: date, semana_txt: str, dia_txt: str, trade_text: str) -> list[dict]:
+    """Una fila de Trades por leg de parse_trades_cell."""
     batch = []
-    for t in parsed:
+    for t in parse_trades_cell(trade_text):
         batch.append({
             "User_id": user_id,
             "fecha": str(fecha_val),
@@ -174,8 +580,216 @@ def insert_trade_entries(user_id: str, fecha_val: date, semana_txt: str, dia_txt
             "be": bool(t["is_be"]),
             "trade": trade_text,
         })
-    if batch:
-        supabase.table("Trades").insert(batch).execute()
+    return batch
+
+
+# =========================
+# 📥 Importación masiva (CSV / Excel con columnas fecha, semana, dia, trade)
+# =========================
+IMPORT_CHUNK = 500     # filas por insert
+IMPORT_WORKERS = 4     # inserts concurrentes
+IMPORT_RETRIES = 3     # intentos por lote (backoff exponencial)
+
+
+def _insert_chunk(user_id: str, batch: list[dict]) -> int:
+    """Upsert idempotente de un lote (ignora claves ya importadas); solo reintenta
+    errores transitorios (_retryable): RLS, JWT vencido o sin import_key fallan a la primera."""
+    for attempt in range(IMPORT_RETRIES):
+        try:
+            _table("Trades", user_id).upsert(batch, on_conflict="User_id,import_key", ignore_duplicates=True).execute()
+            return len(batch)
+        except Exception as e:
+            if attempt == IMPORT_RETRIES - 1 or not _retryable(e):
+                raise
+            time.sleep(2 ** attempt)
+
+
+def import_trade_rows(user_id: str, rows: pd.DataFrame, on_progress=None) -> dict:
+    """Inserta `rows` en lotes de IMPORT_CHUNK con IMPORT_WORKERS hilos.
+    Devuelve {"sent": filas enviadas, "failed": [errores por lote]}; se puede relanzar sin duplicar."""
+    records = rows.astype(object).where(rows.notna(), None).to_dict("records")
+    chunks = [records[i:i + IMPORT_CHUNK] for i in range(0, len(records), IMPORT_CHUNK)]
+    sent, failed = 0, []
+    with ThreadPoolExecutor(max_workers=IMPORT_WORKERS) as pool:
+        futures = [pool.submit(_insert_chunk, user_id, c) for c in chunks]
+        for done, fut in enumerate(as_completed(futures), start=1):
+            try:
+                sent += fut.result()
+            except Exception as e:
+                failed.append(getattr(e, "message", None) or str(e))
+            if on_progress:
+                on_progress(done / len(chunks))  # se llama desde el hilo de Streamlit
+    return {"sent": sent, "failed": failed}
+
+
+# =========================
+# 📨 Cola de escritura de altas (formulario)
+# Las altas se aplican al momento sobre el histórico de la sesión (ids negativos) y un hilo
+# las envía en lotes: altas seguidas se juntan, los fallos transitorios se reintentan con
+# backoff por usuario y, al confirmarse, la versión sube y el siguiente rerun trae las filas
+# reales por delta. Un error definitivo (auth/RLS, datos) descarta las filas y se avisa.
+# =========================
+WRITE_COALESCE = 0.5     # segundos que se esperan más altas antes de enviar el lote
+WRITE_BACKOFF_MAX = 60   # segundos máximos entre reintentos
+# Sin la migración de import_key (sql/trades_import_key.sql): columna o índice único ausentes
+MISSING_IMPORT_KEY = ("PGRST204", "42703", "42P10")
+
+
+def _retryable(e: Exception) -> bool:
+    """Red, 5xx y errores transitorios de Postgres se reintentan; el resto de 4xx no
+    (JWT vencido o ausente, RLS, datos inválidos: reintentar no los arregla)."""
+    if not isinstance(e, APIError):
+        return True  # httpx: timeouts, conexión caída
+    code = str(e.code or "")
+    if len(code) == 3 and code.isdigit():  # respuesta sin JSON: viene el status HTTP
+        return int(code) >= 500 or code in ("408", "429")
+    # PGRST000-003: sin conexión a la base; 08 conexión, 40 rollback/deadlock, 53 recursos, 57 timeout
+    return code.startswith(("PGRST00", "08", "40", "53", "57"))
+
+
+@st.cache_resource(show_spinner=False)
+def _write_queue() -> dict:
+    q = {
+        "cond": threading.Condition(),
+        "pending": {},    # user_id -> filas sin confirmar (con id local negativo)
+        "fails": {},      # user_id -> intentos fallidos seguidos
+        "retry_at": {},   # user_id -> time.monotonic() del próximo intento
+        "errors": {},     # user_id -> último error (se sigue reintentando)
+        "rejected": {},   # user_id -> (legs descartados, error definitivo) aún no mostrado
+        "plain_insert": False,  # la tabla no tiene import_key: insert simple
+        "ids": count(1),
+    }
+    threading.Thread(target=_write_worker, args=(q,), daemon=True, name="trades-writer").start()
+    return q
+
+
+def _write_worker(q: dict):
+    while True:
+        with q["cond"]:
+            while not any(q["pending"].values()):
+                q["cond"].wait()
+        time.sleep(WRITE_COALESCE)  # junta altas seguidas en un solo lote
+        now = time.monotonic()
+        with q["cond"]:
+            batches = {u: list(rows) for u, rows in q["pending"].items()
+                       if rows and q["retry_at"].get(u, 0) <= now}
+        for user_id, rows in batches.items():
+            # Un solo intento por ciclo: el backoff es por usuario y no frena a los demás
+            try:
+                _send_entries(q, user_id, rows)
+            except Exception as e:
+                if _retryable(e):
+                    with q["cond"]:
+                        fails = q["fails"][user_id] = q["fails"].get(user_id, 0) + 1
+                        q["retry_at"][user_id] = time.monotonic() + min(WRITE_BACKOFF_MAX, 2 ** fails)
+                        q["errors"][user_id] = getattr(e, "message", None) or str(e)
+                    continue
+                with q["cond"]:
+                    n, _ = q["rejected"].get(user_id, (0, None))
+                    q["rejected"][user_id] = (n + len(rows), getattr(e, "message", None) or str(e))
+            _settle(q, user_id, {r["id"] for r in rows})
+            bump_trades_version(user_id)
+
+
+def _send_entries(q: dict, user_id: str, rows: list[dict]):
+    """Upsert idempotente por import_key; si la tabla no tiene la migración, insert simple
+    (entonces un reintento tras un timeout que sí escribió puede duplicar la entrada)."""
+    server_rows = [{k: v for k, v in r.items() if k not in ("id", "created_at")} for r in rows]
+    for i in range(0, len(server_rows), IMPORT_CHUNK):
+        batch = server_rows[i:i + IMPORT_CHUNK]
+        if not q["plain_insert"]:
+            try:
+                _table("Trades", user_id).upsert(batch, on_conflict="User_id,import_key", ignore_duplicates=True).execute()
+                continue
+            except APIError as e:
+                if e.code not in MISSING_IMPORT_KEY:
+                    raise
+                q["plain_insert"] = True
+        _table("Trades", user_id).insert([{k: v for k, v in r.items() if k != "import_key"} for r in batch]).execute()
+
+
+def _settle(q: dict, user_id: str, ids: set):
+    """Saca de la cola las filas enviadas (o descartadas) y limpia el estado de reintentos."""
+    with q["cond"]:
+        q["pending"][user_id] = [r for r in q["pending"][user_id] if r["id"] not in ids]
+        q["fails"].pop(user_id, None)
+        q["retry_at"].pop(user_id, None)
+        q["errors"].pop(user_id, None)
+
+
+def enqueue_trade_entries(user_id: str, fecha_val: date, semana_txt: str, dia_txt: str, trade_text: str) -> int:
+    """Encola los legs de una entrada y devuelve cuántos son. import_key hace que
+    reenviar un lote (p.ej. tras un timeout que sí llegó a escribir) no duplique filas."""
+    rows = _entry_rows(user_id, fecha_val, semana_txt, dia_txt, trade_text)
+    if not rows:
+        return 0
+    q = _write_queue()
+    created = datetime.now(timezone.utc).isoformat()
+    with q["cond"]:
+        for r in rows:
+            r.update(id=-next(q["ids"]), created_at=created, import_key=uuid.uuid4().hex)
+        q["pending"].setdefault(user_id, []).extend(rows)
+        q["cond"].notify()
+    return len(rows)
+
+
+def pending_writes(user_id: str) -> tuple[list[dict], str | None]:
+    """(filas encoladas sin confirmar, último error de envío)."""
+    q = _write_queue()
+    with q["cond"]:
+        return list(q["pending"].get(user_id, ())), q["errors"].get(user_id)
+
+
+def take_rejected_writes(user_id: str) -> tuple[int, str] | None:
+    """(legs descartados, error) de altas que el servidor rechazó; se informa una sola vez."""
+    q = _write_queue()
+    with q["cond"]:
+        return q["rejected"].pop(user_id, None)
+
+
+def with_pending(df: pd.DataFrame, pending: list[dict]) -> pd.DataFrame:
+    """Histórico + altas sin confirmar, con el mismo esquema y orden que _trades_frame."""
+    if not pending:
+        return df
+    new = _trades_frame([{c: r.get(c) for c in TRADE_COLUMNS} for r in pending])
+    out = new if df.empty else pd.concat([df, new], ignore_index=True)
+    return _compact_frame(out.sort_values("fecha_dt", kind="stable", ignore_index=True))
+
+
+# =========================
+# ⬇️ Exportación por páginas (CSV / Parquet)
+# =========================
+EXPORT_COLUMNS = TRADE_COLUMNS + ["pts"]
+# point se exporta como texto porque puede traer valores como '2.5%'; pts es el valor normalizado
+EXPORT_SCHEMA = pa.schema([
+    ("id", pa.int64()), ("User_id", pa.string()), ("fecha", pa.date32()), ("semana", pa.string()),
+    ("dia", pa.string()), ("symbol", pa.string()), ("point", pa.string()), ("be", pa.bool_()),
+    ("trade", pa.string()), ("created_at", pa.string()), ("pts", pa.float64()),
+])
+
+
+def export_trades(user_id: str, sink, fmt: str = "csv", date_from: date | None = None,
+                  date_to: date | None = None, symbols: list | None = None) -> int:
+    """Escribe en `sink` (binario) las filas del usuario página a página, sin armar el histórico
+    en memoria. Devuelve la cantidad de filas exportadas."""
+    lo = str(date_from) if date_from else None
+    hi = str(date_to + timedelta(days=1)) if date_to else None
+    writer, n = None, 0
+    try:
+        for page in _iter_pages(user_id, "fecha", lo=lo, hi=hi, symbols=symbols):
+            frame = _trades_frame(page).reindex(columns=EXPORT_COLUMNS)
+            if fmt == "parquet":
+                frame["point"] = frame["point"].astype("string")
+                frame["created_at"] = frame["created_at"].astype("string")
+                writer = writer or pq.ParquetWriter(sink, EXPORT_SCHEMA)
+                writer.write_table(pa.Table.from_pandas(frame, schema=EXPORT_SCHEMA, preserve_index=False))
+            else:
+                sink.write(frame.to_csv(index=False, header=(n == 0)).encode())
+            n += len(frame)
+    finally:
+        if writer is not None:
+            writer.close()
+    return n
 
 
 # =========================
@@ -183,193 +797,207 @@ def insert_trade_entries(user_id: str, fecha_val: date, semana_txt: str, dia_txt
 # =========================
 MONTHS = MONTHS_ES
 
-def month_filter(df: pd.DataFrame, year: int, month: int) -> pd.DataFrame:
-    return df[(pd.to_datetime(df["fecha"]).dt.year == year) & (pd.to_datetime(df["fecha"]).dt.month == month)].copy()
+HIDDEN_COLUMNS = ["fecha_dt"]  # columnas internas que no se muestran ni se exportan
 
 
-import calendar as _pycal
+EQUITY_MAX_POINTS = 1500   # puntos por gráfico de equity tras reducir
+FULL_RES_MAX_POINTS = 5000  # límite de filas de Altair para resolución completa
 
-def calendar_html(year: int, month: int, daily_points: dict[int, float], daily_counts: dict[int, int] | None = None) -> str:
-    """
-    daily_points: {dia -> suma_de_puntos_o_%}
-    daily_counts: {dia -> cantidad_de_trades} (opcional)
-    """
 
-    # ===== helpers de color (verde para +, rojo para -) =====
-    vals = list(daily_points.values()) if daily_points else [0]
-    max_abs = max(1, max(abs(v) for v in vals))
-
-    def bg_for(v: float) -> str:
-        """Color de fondo según magnitud relativa."""
-        if v is None:
-            return "#101317"  # vacío
-        if v == 0:
-            return "#151A21"  # neutro
-        # intensidad 0..1
-        t = min(1.0, abs(v) / max_abs)
-        # color base
-        if v > 0:
-            # verdes
-            # mezclar #1C2B23 (oscuro) con #1F4630 (más brillante)
-            r1,g1,b1 = (0x1C, 0x2B, 0x23)
-            r2,g2,b2 = (0x1F, 0x46, 0x30)
-        else:
-            # rojos
-            r1,g1,b1 = (0x2B, 0x1C, 0x21)
-            r2,g2,b2 = (0x46, 0x1F, 0x2C)
-        r = int(r1 + (r2-r1)*t)
-        g = int(g1 + (g2-g1)*t)
-        b = int(b1 + (b2-b1)*t)
-        return f"rgb({r},{g},{b})"
-
-    def txt_for(v: float) -> str:
-        if v is None or v == 0:
-            return "#cbd5e1"  # gris claro
-        return "#6ee7b7" if v > 0 else "#fca5a5"  # verde/rojo claro
-
-    # ===== CSS =====
-    css = """
-    <style>
-    .cal-wrap{width:100%;overflow-x:auto}
-    table.cal{width:100%;border-collapse:separate;border-spacing:10px;}
-    .cal thead th{
-      background: linear-gradient(135deg,#5662D6,#6C49B8);
-      color:#fff;text-align:center;padding:14px;border-radius:12px;
-      font-weight:800;letter-spacing:.03em
-    }
-    .cal td{
-      background:#101317;border-radius:14px;vertical-align:top;
-      height:120px;padding:10px 10px; position:relative;
-      box-shadow: inset 0 0 0 1px rgba(255,255,255,.04);
-    }
-    .cal .day-badge{
-      position:absolute;top:8px;left:10px;
-      width:28px;height:28px;border-radius:50%;
-      display:flex;align-items:center;justify-content:center;
-      font-weight:700;background:#0f172a;color:#e2e8f0;border:1px solid rgba(255,255,255,.05)
-    }
-    .cal .value{
-      margin-top:34px;text-align:center;font-weight:800;font-size:22px;
-      line-height:1;color:#e2e8f0;text-shadow:0 1px 0 rgba(0,0,0,.25)
-    }
-    .cal .pill{
-      margin:8px auto 0 auto;display:inline-block;min-width:84px;text-align:center;
-      padding:6px 10px;border-radius:999px;font-size:12px;
-      background:rgba(255,255,255,.06);color:#cbd5e1;border:1px solid rgba(255,255,255,.07)
-    }
-    .cal .muted{opacity:.35}
-    </style>
-    """
+def downsample_equity(df: pd.DataFrame, col: str, max_points: int = EQUITY_MAX_POINTS) -> pd.DataFrame:
+    """Reduce la curva a ~max_points conservando su forma: mínimo y máximo de cada tramo,
+    primer y último punto, y siempre el pico y el valle del max drawdown."""
+    n = len(df)
+    if n <= max_points:
+        return df
+    y = df[col].to_numpy(dtype="float64")
+    buckets = max(1, (max_points - 4) // 2)
+    by = pd.Series(y).groupby(np.arange(n) * buckets // n)
+    trough = int(np.argmax(np.maximum.accumulate(y) - y))
+    peak = int(np.argmax(y[:trough + 1]))
+    keep = np.unique(np.concatenate([by.idxmin().to_numpy(), by.idxmax().to_numpy(), [0, n - 1, peak, trough]]))
+    return df.iloc[keep]
 
-    # ===== Cabecera y grilla =====
-    cal = _pycal.Calendar(firstweekday=6)  # Domingo
-    weeks = cal.monthdayscalendar(year, month)
-    header = "<tr>" + "".join(f"<th>{d}</th>" for d in ["DOM","LUN","MAR","MIE","JUE","VIE","SAB"]) + "</tr>"
-
-    body_rows = []
-    for week in weeks:
-        tds = []
-        for d in week:
-            if d == 0:
-                tds.append('<td class="muted"></td>')
-                continue
 
-            val = float(daily_points.get(d, 0)) if d in daily_points else 0.0
-            cnt = daily_counts.get(d, 0) if (daily_counts is not None) else None
-            bg = bg_for(val)
-            c  = txt_for(val)
-
-            # Formato del valor grande (usa % si lo tuyo ahora es porcentaje)
-            val_txt = f"{int(val)}"  # o f"{val:.1f}%" si quieres 1 decimal
-
-            pill_txt = f"{cnt} trade" + ("s" if (cnt or 0) != 1 else "") if cnt is not None else ""
-
-            tds.append(
-                f"""
-                <td style="background:{bg}">
-                  <div class="day-badge">{d}</div>
-                  <div class="value" style="color:{c}">{val_txt}</div>
-                  {f'<div class="pill">{pill_txt}</div>' if cnt is not None else ''}
-                </td>
-                """
-            )
-        body_rows.append("<tr>" + "".join(tds) + "</tr>")
-
-    html = f"""
-    <div class="cal-wrap">
-      {css}
-      <table class="cal">
-        <thead>{header}</thead>
-        <tbody>
-          {''.join(body_rows)}
-        </tbody>
-      </table>
-    </div>
-    """
-    return html
+BE_FILTERS = ["Todos", "Solo BE", "Sin BE"]
+
+
+def history_rows(df: pd.DataFrame, date_from: date | None = None, date_to: date | None = None,
+                 symbols: list | None = None, be_mode: str = "Todos") -> np.ndarray:
+    """Posiciones (orden ascendente por fecha) de las filas que pasan los filtros.
+    El rango de fechas es un slice por búsqueda binaria sobre fecha_dt; símbolo y BE
+    solo recorren ese rango."""
+    lo, hi = 0, len(df)
+    if date_from is not None:
+        lo = int(df["fecha_dt"].searchsorted(pd.Timestamp(date_from)))
+    if date_to is not None:
+        hi = int(df["fecha_dt"].searchsorted(pd.Timestamp(date_to) + pd.Timedelta(days=1)))
+    hi = max(lo, hi)
+    if not symbols and be_mode == "Todos":
+        return np.arange(lo, hi)
+    part = df.iloc[lo:hi]
+    mask = np.ones(len(part), dtype=bool)
+    if symbols:
+        mask &= part["symbol"].isin(symbols).to_numpy()
+    if be_mode != "Todos":
+        mask &= part["be"].astype(bool).to_numpy() == (be_mode == "Solo BE")
+    return np.flatnonzero(mask) + lo
+
+
+def history_page(df: pd.DataFrame, rows: np.ndarray, desc: bool = True, page: int = 1, page_size: int = 50) -> pd.DataFrame:
+    """Solo las filas de la página pedida; el orden se resuelve con posiciones (sin sort_values)."""
+    if desc:
+        rows = rows[::-1]
+    start = (max(1, page) - 1) * page_size
+    return df.iloc[rows[start:start + page_size]]
+
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def local_monthly_summary(user_id: str, version: int = 0) -> pd.DataFrame:
+    """monthly_summary del histórico cacheado; se recalcula solo cuando cambia la versión."""
+    return monthly_summary(fetch_trades(user_id, version))
+
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def local_daily_totals(user_id: str, version: int = 0) -> pd.DataFrame:
+    """daily_totals del histórico cacheado (base del mapa de calor)."""
+    return daily_totals(fetch_trades(user_id, version))
+
+
+def daily_digest(daily: pd.DataFrame) -> str:
+    """Huella del agregado diario del mes (día, pts, trades)."""
+    return hashlib.blake2b(pd.util.hash_pandas_object(daily).to_numpy().tobytes(), digest_size=16).hexdigest()
+
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def month_calendar(year: int, month: int, digest: str, _points: dict, _counts: dict) -> str:
+    """calendar_html sin CSS memorizado por (año, mes, digest): mientras el agregado del mes
+    no cambie, los reruns reutilizan el HTML en vez de volver a armar cada celda."""
+    return calendar_html(year, month, _points, _counts, css=False)
 
 
 # =========================
-# 📊 Métricas
+# 📊 Métricas (cálculo en journal_core; aquí el estado por usuario en su snapshot)
 # =========================
-@st.cache_data(show_spinner=False)
-def compute_metrics(df_trades: pd.DataFrame):
-    if df_trades.empty:
-        return {
-            "equity_df": pd.DataFrame(),
-            "wins": 0, "loss": 0, "be_ct": 0,
-            "win_rate": 0.0, "avg_win": 0.0, "avg_loss": 0.0,
-            "profit_factor": np.nan, "expectancy": 0.0,
-            "max_dd": 0,
-        }
-
-    df = df_trades.copy()
-# Si tu columna se llama "point"
-    df["pts"] = df.apply(lambda r: _safe_pts(r, "point"), axis=1)
-
-# Si la cambiaste a "porcentaje", usa esta en su lugar:
-# df["pts"] = df.apply(lambda r: _safe_pts(r, "porcentaje"), axis=1)
-
-    df = df.sort_values("fecha")
-
-    # Equity global
-    df_equity = df[["fecha","pts"]].copy()
-    df_equity["equity"] = df_equity["pts"].cumsum()
-
-    wins = (df["pts"] > 0).sum()
-    loss = (df["pts"] < 0).sum()
-    be_ct = (df.get("be", False) == True).sum()
-
-    sum_wins = df.loc[df["pts"] > 0, "pts"].sum()
-    sum_loss = -df.loc[df["pts"] < 0, "pts"].sum()
-
-    tot = wins + loss
-    win_rate = wins / tot if tot else 0.0
-    avg_win = (sum_wins / wins) if wins else 0.0
-    avg_loss = (sum_loss / loss) if loss else 0.0
-    profit_factor = (sum_wins / sum_loss) if sum_loss else np.inf
-    expectancy = (win_rate * avg_win) - ((1 - win_rate) * avg_loss)
-
-    roll_max = np.maximum.accumulate(df_equity["equity"].values)
-    drawdowns = roll_max - df_equity["equity"].values
-    max_dd = int(np.max(drawdowns)) if len(drawdowns) else 0
+def trades_metrics(user_id: str, df: pd.DataFrame) -> dict:
+    """Métricas globales del usuario desde el acumulador de su snapshot.
+    Si no hay acumulador para este histórico (snapshot expulsado), se reconstruye desde df."""
+    snap = _trade_snapshots()["users"].get(user_id)
+    acc = snap.get("metrics") if snap is not None else None
+    if acc is None or acc["n"] != len(df):
+        acc = _metrics_build(df)
+        if snap is not None and len(snap["df"]) == len(df):
+            snap["metrics"] = acc
+    return _metrics_result(acc)
+
+
+def trades_breakdown(user_id: str, df: pd.DataFrame) -> dict:
+    """compute_breakdown guardado en el snapshot del usuario junto a sus métricas;
+    se recalcula cuando cambia el histórico (n distinto o snapshot nuevo)."""
+    snap = _trade_snapshots()["users"].get(user_id)
+    cached = snap.get("breakdown") if snap is not None else None
+    if cached is not None and cached["n"] == len(df):
+        return cached["result"]
+    result = compute_breakdown(df)
+    if snap is not None and len(snap["df"]) == len(df):
+        snap["breakdown"] = {"n": len(df), "result": result}
+    return result
+
+
+# =========================
+# 🎲 Monte Carlo (bootstrap de pts)
+# =========================
+MC_WORKERS = int(st.secrets.get("MC_WORKERS", 1))  # >1: lotes en procesos aparte (una CPU libre por proceso)
+
+
+@st.cache_resource(show_spinner=False)
+def _mc_pool() -> ProcessPoolExecutor | None:
+    """Pool de procesos compartido; "spawn" para no clonar los hilos del servidor."""
+    if MC_WORKERS <= 1:
+        return None
+    return ProcessPoolExecutor(MC_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def monte_carlo(user_id: str, version: int, n_paths: int, horizon: int, ruin: float, seed: int, _pts: np.ndarray) -> dict:
+    """Resumen de simulate_paths cacheado por (usuario, versión, parámetros);
+    _pts no entra en la clave (lo fija la versión de datos)."""
+    sim = simulate_paths(_pts, n_paths, horizon, ruin, seed, executor=_mc_pool())
+    bands = pd.DataFrame({
+        "Equity final": np.percentile(sim["final"], MC_PERCENTILES),
+        "Max drawdown": np.percentile(sim["max_dd"], MC_PERCENTILES),
+    }, index=pd.Index([f"P{q}" for q in MC_PERCENTILES], name="Percentil"))
+    counts, edges = np.histogram(sim["final"], bins=60)
+    hist = pd.DataFrame({"desde": edges[:-1], "hasta": edges[1:], "caminos": counts})
+    return {"bands": bands, "hist": hist, "ruin": sim["ruin"], "mean_final": float(sim["final"].mean())}
+
+
+# =========================
+# ⏱️ Instrumentación por rerun (opt-in: secret PROFILE = "on" o ?profile=1 en la URL)
+# =========================
+PROFILE = str(st.secrets.get("PROFILE", "off")).lower() in ("1", "true", "on")
+PROFILE_LOG = Path(st.secrets.get("PROFILE_LOG", ".cache/profile.jsonl"))  # una línea JSON por rerun
+
+
+@st.cache_resource(show_spinner=False)
+def _profile_log_lock() -> threading.Lock:
+    return threading.Lock()
+
+
+def _frame_bytes(df) -> int:
+    """Tamaño aproximado (sin recorrer strings) de un DataFrame."""
+    return int(df.memory_usage(index=False).sum()) if df is not None and not df.empty else 0
+
+
+def profile_start(user_id: str, scope: str = "app") -> dict | None:
+    """Abre el perfil de un rerun (scope "app") o de un fragmento;
+    None si la instrumentación está apagada (coste cero)."""
+    if not (PROFILE or "profile" in st.experimental_get_query_params()):
+        return None
+    now = time.perf_counter()
+    return {"user": user_id, "scope": scope, "t0": now, "t": now, "stages": {}}
+
+
+def profile_lap(prof: dict | None, stage: str, rows: int = 0, nbytes: int = 0):
+    """Atribuye a `stage` el tiempo desde la marca anterior (las repeticiones se suman)."""
+    if prof is None:
+        return
+    now = time.perf_counter()
+    rec = prof["stages"].setdefault(stage, {"ms": 0.0, "rows": 0, "bytes": 0})
+    rec["ms"] += (now - prof["t"]) * 1000
+    rec["rows"] += int(rows)
+    rec["bytes"] += int(nbytes)
+    prof["t"] = now
+
+
+def profile_finish(prof: dict | None):
+    """Una línea JSON en PROFILE_LOG. El perfil "app" además dibuja en la barra lateral
+    el desglose del rerun con el último de cada fragmento (los fragmentos no pueden
+    escribir en la barra lateral; sus reruns parciales se ven en el siguiente rerun completo)."""
+    if prof is None:
+        return
+    total = (time.perf_counter() - prof["t0"]) * 1000
+    stages = {k: {**v, "ms": round(v["ms"], 2)} for k, v in prof["stages"].items()}
+    last = st.session_state.setdefault("profile_last", {})
+    last[prof["scope"]] = {"total_ms": round(total, 2), "stages": stages}
+    if prof["scope"] == "app":
+        rows = [{"scope": sc, "stage": k, **v} for sc, p in last.items() for k, v in p["stages"].items()]
+        with st.sidebar.expander(f"⏱️ Rerun: {total:.0f} ms"):
+            st.dataframe(pd.DataFrame(rows), use_container_width=True, hide_index=True)
+    line = {"ts": datetime.now().isoformat(timespec="seconds"), "user": prof["user"],
+            "scope": prof["scope"], "total_ms": round(total, 2), "stages": stages}
+    try:
+        PROFILE_LOG.parent.mkdir(parents=True, exist_ok=True)
+        with _profile_log_lock(), PROFILE_LOG.open("a", encoding="utf-8") as f:
+            f.write(json.dumps(line) + "\n")
+    except OSError:
+        pass  # el log es opcional: nunca rompe la app
+
 
-    return {
-        "equity_df": df_equity,
-        "wins": int(wins), "loss": int(loss), "be_ct": int(be_ct),
-        "win_rate": float(win_rate), "avg_win": float(avg_win), "avg_loss": float(avg_loss),
-        "profit_factor": float(profit_factor) if np.isfinite(profit_factor) else np.inf,
-        "expectancy": float(expectancy),
-        "max_dd": int(max_dd),
-    }
     # Revisar si hay token persistente en la URL
 params = st.experimental_get_query_params()
 if "token" in params:
-    token = params["token"][0]
-    supabase.postgrest.auth(token)
-    user = supabase.auth.get_user(token)
-    if user and user.user:
-        st.session_state.auth = {"user": user.user, "access_token": token}
+    restore_session(params["token"][0])
 
 # =========================
 # 🔑 Login UI
@@ -403,65 +1031,83 @@ def login_view():
 # 🧭 App principal
 # =========================
 
-def app_view():
-    user = st.session_state.auth.get("user")
-    if not user:
-        st.error("Sesión inválida."); do_sign_out(); st.stop()
-
-    # Asegura token para RLS
-    if st.session_state.auth.get("access_token"):
-        supabase.postgrest.auth(st.session_state.auth["access_token"])
-
-    st.sidebar.write(f"👤 Usuario: **{user.email}**")
-    if st.sidebar.button("Cerrar sesión"):
-        do_sign_out(); st.rerun()
-
-    # 1) Cargar datos
-    df = fetch_trades(user.id)
-
-    # 2) Filtros
-    years = sorted(pd.to_datetime(df["fecha"]).dt.year.unique()) if not df.empty else [datetime.now().year]
-    year_sel = st.sidebar.selectbox("Año", years, index=len(years)-1)
-    month_name = st.sidebar.selectbox("Mes", MONTHS, index=(datetime.now().month-1))
+def session_trades(user_id: str, ver: int) -> pd.DataFrame:
+    """Histórico de fetch_trades memorizado en la sesión para esta versión, más las altas
+    aún en la cola de escritura; los fragmentos lo comparten sin volver a copiarlo."""
+    pending, _ = pending_writes(user_id)
+    key = (user_id, ver, tuple(r["id"] for r in pending))
+    memo = st.session_state.get("trades_memo")
+    if memo is None or memo[0] != key:
+        memo = (key, with_pending(fetch_trades(user_id, ver), pending))
+        st.session_state.trades_memo = memo
+    return memo[1]
+
+
+def monthly_aggregates(user_id: str, ver: int) -> pd.DataFrame:
+    """Resumen mensual: vista del servidor si está disponible; con altas pendientes
+    (el servidor va por detrás) o sin vistas, groupby local del histórico."""
+    pending = has_pending_writes(user_id)
+    monthly = fetch_monthly_summary(user_id, ver) if SERVER_AGGREGATES and not pending else None
+    if monthly is None:
+        monthly = monthly_summary(session_trades(user_id, ver)) if pending else local_monthly_summary(user_id, ver)
+    return monthly
+
+
+def has_pending_writes(user_id: str) -> bool:
+    """Con altas sin confirmar los agregados del servidor van por detrás: se usa el groupby local."""
+    return bool(pending_writes(user_id)[0])
+
+
+def flash(kind: str, msg: str):
+    """Mensaje que sobrevive al st.rerun() tras escribir (se muestra en el siguiente rerun)."""
+    st.session_state.flash = (kind, msg)
+
+
+# Cada vista es un fragmento: sus widgets solo rerunean su propio cuerpo.
+# Leen la versión en vivo: el hilo de escritura la sube al confirmar, sin rerun completo.
+
+@st.fragment
+def month_view(user_id: str):
+    """Selectores de mes y símbolos, calendario y equity mensual."""
+    prof = profile_start(user_id, "month")
+    ver = trades_version(user_id)
+    monthly = monthly_aggregates(user_id, ver)
+    years = sorted(int(y) for y in monthly["year"].unique()) if not monthly.empty else [datetime.now().year]
+    symbols = sorted([s for s in monthly["symbol"].dropna().unique()]) if not monthly.empty else []
+    s1, s2, s3 = st.columns([1, 1, 3])
+    with s1:
+        year_sel = st.selectbox("Año", years, index=len(years)-1)
+    with s2:
+        month_name = st.selectbox("Mes", MONTHS, index=(datetime.now().month-1))
+    with s3:
+        sym_choice = st.multiselect("Símbolos", options=symbols, default=symbols)
     month_sel = MONTHS.index(month_name) + 1
-    symbols = sorted([s for s in df["symbol"].dropna().unique()]) if not df.empty else []
-    sym_choice = st.sidebar.multiselect("Símbolos", options=symbols, default=symbols)
-
-    st.title("📊 Trading Journal Pro — Supabase")
-
-    # 3) Mes actual filtrado
-    df_m = month_filter(df, year_sel, month_sel)
-    if sym_choice:
-        df_m = df_m[(df_m["symbol"].isin(sym_choice)) | (df_m["symbol"].isna())]
-
-    # Calcula pts una vez
-    if not df_m.empty:
-        df_m = df_m.copy()
-        df_m["pts"] = df_m.apply(lambda r: _safe_pts(r, "point"), axis=1)  # o "porcentaje" si renombraste
-        df_m = df_m.sort_values("fecha")
+    profile_lap(prof, "filter")
+
+    # === Calendario primero (solo necesita los agregados del mes) ===
+    daily = fetch_daily_summary(user_id, year_sel, month_sel, ver) if SERVER_AGGREGATES and not has_pending_writes(user_id) else None
+    if daily is None:
+        df = session_trades(user_id, ver)
+        profile_lap(prof, "fetch", len(df), _frame_bytes(df))
+        daily = daily_summary(month_filter(df, year_sel, month_sel))
+    else:
+        profile_lap(prof, "fetch", len(daily), _frame_bytes(daily))
+    daily = filter_symbols(daily, sym_choice).groupby("day").agg(pts=("pts", "sum"), trades=("trades", "sum"))
+    profile_lap(prof, "normalize", len(daily))
 
-    # === Calendario primero ===
     st.subheader(f"Calendario Mensual — {MONTHS[month_sel-1]} {year_sel}")
+    # {día: suma} (BE ya vale 0 en pts) y {día: cantidad}; solo se usan si el digest es nuevo
+    html = month_calendar(year_sel, month_sel, daily_digest(daily), daily["pts"].to_dict(), daily["trades"].to_dict())
+    st.markdown(html, unsafe_allow_html=True)
+    profile_lap(prof, "calendar", len(daily), len(html))
+
+    # Mes actual filtrado (pts ya viene normalizado desde fetch_trades)
+    df = session_trades(user_id, ver)
+    profile_lap(prof, "fetch")
+    df_m = filter_symbols(month_filter(df, year_sel, month_sel), sym_choice)
     if not df_m.empty:
-        df_m["day"] = pd.to_datetime(df_m["fecha"]).dt.day
-        daily_map = df_m.groupby("day")["pts"].sum().to_dict()
-    else:
-        daily_map = {}
-    st.markdown(calendar_html(year_sel, month_sel, daily_map), unsafe_allow_html=True)
-# df_m: DataFrame del mes filtrado (ya con columnas: fecha, point, be, etc.)
-# Si ahora trabajas en %, usa la columna 'point' como porcentaje.
-df_m_cal = df_m.copy()
-df_m_cal["day"] = pd.to_datetime(df_m_cal["fecha"]).dt.day
-
-# Suma del día (ignora BE si be == True)
-df_m_cal["pts"] = df_m_cal.apply(lambda r: 0 if bool(r.get("be", False)) else float(r.get("point") or 0), axis=1)
-
-daily_points = df_m_cal.groupby("day")["pts"].sum().to_dict()          # {día: suma}
-daily_counts = df_m_cal.groupby("day")["pts"].count().to_dict()        # {día: cantidad}
-
-st.subheader(f"Calendario Mensual — {MONTHS[month_sel-1]} {year_sel}")
-html = calendar_html(year_sel, month_sel, daily_points, daily_counts)
-st.markdown(html, unsafe_allow_html=True)
+        df_m = df_m.sort_values("fecha")
+    profile_lap(prof, "filter", len(df_m), _frame_bytes(df_m))
 
     st.markdown("---")
 
@@ -470,7 +1116,7 @@ st.markdown(html, unsafe_allow_html=True)
     if not df_m.empty:
         df_m_eq = df_m[["fecha","pts"]].copy()
         df_m_eq["equity_m"] = df_m_eq["pts"].cumsum()
-        chart_m = alt.Chart(df_m_eq).mark_line(point=True).encode(
+        chart_m = alt.Chart(downsample_equity(df_m_eq, "equity_m")).mark_line(point=True).encode(
             x=alt.X("fecha:T", title="Fecha"),
             y=alt.Y("equity_m:Q", title="Acumulado (mes)"),
             tooltip=["fecha:T","equity_m:Q"],
@@ -478,22 +1124,63 @@ st.markdown(html, unsafe_allow_html=True)
         st.altair_chart(chart_m, use_container_width=True)
     else:
         st.info("Sin trades en el mes seleccionado.")
+    profile_lap(prof, "charts", len(df_m))
+    profile_finish(prof)
 
 
-
-
-    # Métricas globales
-    metrics = compute_metrics(df)
+@st.fragment
+def global_view(user_id: str):
+    """Equity global (zoom y resolución) y métricas de todo el histórico."""
+    prof = profile_start(user_id, "global")
+    df = session_trades(user_id, trades_version(user_id))
+    metrics = trades_metrics(user_id, df)
+    profile_lap(prof, "metrics", len(df), _frame_bytes(metrics["equity_df"]))
     colA, colB = st.columns([2,1])
     with colA:
         st.subheader("Equity Global")
         if not metrics["equity_df"].empty:
-            chart = alt.Chart(metrics["equity_df"]).mark_line(point=True).encode(
+            eq = metrics["equity_df"]
+            f_min, f_max = eq["fecha"].min(), eq["fecha"].max()
+            z1, z2 = st.columns([3,1])
+            with z1:
+                zoom = st.date_input("Rango", value=(f_min, f_max), min_value=f_min, max_value=f_max, key="eq_zoom")
+            if isinstance(zoom, (tuple, list)) and len(zoom) == 2 and tuple(zoom) != (f_min, f_max):
+                eq = eq[eq["fecha"].between(zoom[0], zoom[1])]
+            with z2:
+                full_res = st.toggle("Resolución completa", disabled=len(eq) > FULL_RES_MAX_POINTS,
+                                     help=f"Disponible con hasta {FULL_RES_MAX_POINTS} trades en el rango")
+            eq_plot = eq if (full_res and len(eq) <= FULL_RES_MAX_POINTS) else downsample_equity(eq, "equity")
+            chart = alt.Chart(eq_plot).mark_line(point=len(eq_plot) == len(eq)).encode(
                 x=alt.X("fecha:T", title="Fecha"),
                 y=alt.Y("equity:Q", title="porcentaje acumulados"),
                 tooltip=["fecha:T","equity:Q"],
             ).properties(height=360)
             st.altair_chart(chart, use_container_width=True)
+            if len(eq_plot) < len(eq):
+                st.caption(f"Mostrando {len(eq_plot)} de {len(eq)} puntos (se conservan extremos y el max drawdown).")
+            profile_lap(prof, "charts", len(eq_plot), _frame_bytes(eq_plot))
+
+            st.subheader("Métricas móviles")
+            r1, r2, r3 = st.columns([1,1,2])
+            with r1:
+                r_win = st.number_input("Ventana", min_value=2, value=50, step=10, key="roll_window")
+            with r2:
+                r_by = st.radio("Unidad", ["trades", "días"], horizontal=True, key="roll_by")
+            with r3:
+                r_metric = st.selectbox("Métrica", list(ROLLING_METRICS), format_func=ROLLING_METRICS.get, key="roll_metric")
+            roll = rolling_metrics(df, int(r_win), "days" if r_by == "días" else "trades")
+            if len(eq) < len(df):
+                roll = roll[roll["fecha"].between(eq["fecha"].min(), eq["fecha"].max())]
+            # PF sin pérdidas en la ventana es ∞: no se dibuja
+            roll = roll[["fecha", r_metric]].replace([np.inf, -np.inf], np.nan).dropna()
+            roll_plot = downsample_equity(roll.reset_index(drop=True), r_metric)
+            chart_r = alt.Chart(roll_plot).mark_line().encode(
+                x=alt.X("fecha:T", title="Fecha"),
+                y=alt.Y(f"{r_metric}:Q", title=f"{ROLLING_METRICS[r_metric]} ({int(r_win)} {r_by})"),
+                tooltip=["fecha:T", f"{r_metric}:Q"],
+            ).properties(height=220)
+            st.altair_chart(chart_r, use_container_width=True)
+            profile_lap(prof, "charts", len(roll), _frame_bytes(roll_plot))
         else:
             st.info("Sin datos aún. Agrega tus primeros trades.")
     with colB:
@@ -506,66 +1193,319 @@ st.markdown(html, unsafe_allow_html=True)
         with c4: st.metric("Profit Factor", f"{metrics['profit_factor']:.2f}" if np.isfinite(metrics['profit_factor']) else "∞")
         with c5: st.metric("Expectancy", f"{metrics['expectancy']:.2f}")
         st.caption(f"Max Drawdown: **{metrics['max_dd']}** pts")
+        streaks = streak_metrics(df)
+        c6,c7 = st.columns(2)
+        with c6: st.metric("Racha ganadora", streaks["max_win_streak"])
+        with c7: st.metric("Racha perdedora", streaks["max_loss_streak"])
+        st.caption(f"Bajo el agua: **{streaks['underwater_pct']*100:.0f}%** de los trades · "
+                   f"máx. {streaks['underwater_max_trades']} trades / {streaks['underwater_max_days']} días"
+                   + (f" · actual {streaks['underwater_now_days']} días" if streaks["underwater_now_days"] else ""))
+    profile_lap(prof, "metrics")
+    profile_finish(prof)
+
+
+@st.fragment
+def history_view(user_id: str):
+    """Histórico filtrable y paginado, con exportación."""
+    prof = profile_start(user_id, "history")
+    st.subheader("Histórico (filtrable)")
+    ver = trades_version(user_id)
+    df = session_trades(user_id, ver)
+    if df.empty:
+        st.info("No hay datos.")
+    else:
+        f_min, f_max = df["fecha"].min(), df["fecha"].max()
+        h1, h2, h3, h4 = st.columns([2,2,1,1])
+        with h1:
+            h_rango = st.date_input("Fechas", value=(f_min, f_max), min_value=f_min, max_value=f_max, key="hist_rango")
+        with h2:
+            monthly = monthly_aggregates(user_id, ver)
+            h_syms = st.multiselect("Símbolos", options=sorted(monthly["symbol"].dropna().unique()), key="hist_syms")
+        with h3:
+            h_be = st.selectbox("BE", BE_FILTERS, key="hist_be")
+        with h4:
+            h_orden = st.selectbox("Orden", ["Recientes", "Antiguos"], key="hist_orden")
+        d_from, d_to = (h_rango[0], h_rango[1]) if isinstance(h_rango, (tuple, list)) and len(h_rango) == 2 else (None, None)
+
+        p1, p2 = st.columns([1,1])
+        with p2:
+            h_size = st.selectbox("Filas por página", [25, 50, 100, 250], index=1, key="hist_size")
+        rows = history_rows(df, d_from, d_to, h_syms, h_be)
+        total = len(rows)
+        n_pages = max(1, -(-total // h_size))
+        filters = (d_from, d_to, tuple(h_syms), h_be, h_orden, h_size)
+        if st.session_state.get("hist_filters") != filters:
+            st.session_state.hist_filters = filters
+            st.session_state.hist_page = 1  # filtros nuevos: vuelta a la primera página
+        with p1:
+            h_page = st.number_input("Página", min_value=1, max_value=n_pages, step=1, key="hist_page")
+        page_df = history_page(df, rows, desc=(h_orden == "Recientes"), page=int(h_page), page_size=h_size)
+        st.dataframe(page_df.drop(columns=HIDDEN_COLUMNS), use_container_width=True, hide_index=True)
+        first_row = (int(h_page) - 1) * h_size
+        st.caption(f"Filas {min(total, first_row + 1)}–{min(total, first_row + h_size)} de {total} · página {int(h_page)} de {n_pages}")
+        profile_lap(prof, "tabs", len(page_df), _frame_bytes(page_df))
+
+        with st.expander("⬇️ Exportar"):
+            st.caption("Usa el rango de fechas y los símbolos de arriba. El archivo se genera solo al pedirlo.")
+            e_fmt = st.radio("Formato", ["CSV", "Parquet"], horizontal=True, key="exp_fmt")
+            if st.button("Preparar archivo", disabled=trades_offline(user_id)):
+                fmt = e_fmt.lower()
+                # Se escribe a disco por páginas; download_button necesita los bytes finales
+                with tempfile.TemporaryFile() as sink:
+                    with st.spinner("Exportando…"):
+                        n = export_trades(user_id, sink, fmt, d_from, d_to, h_syms)
+                    sink.seek(0)
+                    st.download_button(f"Descargar {e_fmt} ({n} filas)", sink.read(), file_name=f"journal.{fmt}",
+                                       mime="text/csv" if fmt == "csv" else "application/octet-stream")
+        profile_lap(prof, "export")
+    profile_finish(prof)
+
+
+@st.fragment
+def entry_view(user_id: str):
+    st.subheader("Agregar Nueva Entrada")
+    with st.form("new_entry", clear_on_submit=True):
+        c1,c2,c3 = st.columns(3)
+        with c1:
+            f_fecha = st.date_input("Fecha", value=date.today())
+        with c2:
+            semana_numero = datetime.combine(f_fecha, datetime.min.time()).isocalendar()[1]
+            f_semana = st.text_input("Semana", value=f"Semana {semana_numero}")
+        with c3:
+            dia_txt = ES_DAYS[datetime.combine(f_fecha, datetime.min.time()).weekday()]
+            f_dia = st.text_input("Día", value=dia_txt)
+        f_trade = st.text_area("Trade(s)", placeholder="Ej: NQ:+50P ~ ES:-20P ~ NQ:BE", help="Separa con '~'. Usa 'BE' para Break Even.")
+        submitted = st.form_submit_button("Guardar ✅", disabled=trades_offline(user_id))
+        if submitted:
+            if not f_trade.strip():
+                st.error("Ingresa al menos un trade.")
+            else:
+                n = enqueue_trade_entries(user_id, f_fecha, f_semana, f_dia, f_trade)
+                if not n:
+                    st.error("No se reconoció ningún trade (formato: NQ:+50P, ES:-20P, BE).")
+                else:
+                    # Ya se ve en calendario y métricas; el envío sigue en segundo plano
+                    flash("success", f"Guardado ({n} legs). Sincronizando con Supabase…")
+                    st.rerun()
+    pending, error = pending_writes(user_id)
+    if pending:
+        st.caption(f"⏳ {len(pending)} legs pendientes de confirmar por Supabase.")
+    if error:
+        st.warning(f"No se pudo guardar todavía; se reintentará sola: {error}")
+
+
+@st.fragment
+def summary_view(user_id: str):
+    st.subheader("Resultados por Mes")
+    monthly = monthly_aggregates(user_id, trades_version(user_id))
+    if monthly.empty:
+        st.info("No hay datos para resumir.")
+    else:
+        monthly = monthly.groupby(["year","month"]).agg(total_pts=("pts","sum"), trades=("trades","sum")).reset_index()
+        monthly["Periodo"] = monthly.apply(lambda r: f"{MONTHS[int(r['month'])-1]} {int(r['year'])}", axis=1)
+        monthly = monthly.sort_values(["year","month"]) 
+        st.dataframe(monthly[["Periodo","total_pts","trades"]].rename(columns={"total_pts":"porcentaje","trades":"#Trades"}), use_container_width=True)
+
+
+HEATMAP_MAX_YEARS = 10  # ~3.7k celdas como mucho: por debajo del límite de filas de Altair
+
+
+@st.fragment
+def heatmap_view(user_id: str):
+    """Mapa de calor diario de uno o varios años: un solo groupby y un solo gráfico."""
+    st.subheader("Mapa de calor diario")
+    ver = trades_version(user_id)
+    daily = daily_totals(session_trades(user_id, ver)) if has_pending_writes(user_id) else local_daily_totals(user_id, ver)
+    if daily.empty:
+        st.info("No hay datos para el mapa de calor.")
+        return
+    years = sorted(int(y) for y in daily["fecha"].dt.year.unique())
+    y0, y1 = (years[0], years[-1]) if len(years) == 1 else st.select_slider(
+        "Años", options=years, value=(years[-1], years[-1]), key="heat_years")
+    if y1 - y0 + 1 > HEATMAP_MAX_YEARS:
+        y0 = y1 - HEATMAP_MAX_YEARS + 1
+        st.caption(f"Se muestran los últimos {HEATMAP_MAX_YEARS} años del rango.")
+    hm = heatmap_frame(daily[daily["fecha"].dt.year.between(y0, y1)])
+    lim = float(hm["pts"].abs().quantile(0.95)) or 1.0  # los días extremos no apagan al resto
+    chart = alt.Chart(hm).mark_rect(cornerRadius=2).encode(
+        x=alt.X("week:O", title=None, axis=alt.Axis(labels=False, ticks=False)),
+        y=alt.Y("dia:O", title=None, sort=WEEKDAYS_SHORT),
+        color=alt.Color("pts:Q", title="pts", scale=alt.Scale(scheme="redyellowgreen", domain=[-lim, lim], domainMid=0, clamp=True)),
+        tooltip=[alt.Tooltip("fecha:T", title="Fecha"), alt.Tooltip("pts:Q", title="pts"), alt.Tooltip("trades:Q", title="#Trades")],
+    ).properties(width=alt.Step(13), height=alt.Step(13)).facet(row=alt.Row("year:O", title=None))
+    st.altair_chart(chart)
+
+
+def _breakdown_table(res: pd.DataFrame) -> pd.DataFrame:
+    t = res.assign(win_rate=res["win_rate"] * 100).round({"win_rate": 1, "avg_win": 1, "avg_loss": 1, "profit_factor": 2, "expectancy": 2})
+    return t.rename(columns={"trades": "#Trades", "win_rate": "Win Rate %", "avg_win": "Avg Win", "avg_loss": "Avg Loss",
+                             "profit_factor": "Profit Factor", "expectancy": "Expectancy", "pts": "Total", "max_dd": "Max DD",
+                             "wins": "Wins", "loss": "Losses", "be_ct": "BE"})
+
+
+@st.fragment
+def breakdown_view(user_id: str):
+    """Win rate, profit factor, expectancy y drawdown por instrumento y por día."""
+    prof = profile_start(user_id, "breakdown")
+    df = session_trades(user_id, trades_version(user_id))
+    res = trades_breakdown(user_id, df)
+    profile_lap(prof, "metrics", len(df))
+    if df.empty:
+        st.info("No hay datos.")
+    else:
+        st.subheader("Por símbolo")
+        st.dataframe(_breakdown_table(res["symbol"]), use_container_width=True)
+        st.subheader("Por día de la semana")
+        st.dataframe(_breakdown_table(res["dia"]), use_container_width=True)
+    profile_lap(prof, "tabs")
+    profile_finish(prof)
+
+
+@st.fragment
+def risk_view(user_id: str):
+    """Bootstrap de los pts históricos: bandas de equity final, drawdown y riesgo de ruina."""
+    ver = trades_version(user_id)
+    df = session_trades(user_id, ver)
+    if df.empty:
+        st.info("No hay datos.")
+        return
+    hist_dd = trades_metrics(user_id, df)["max_dd"]
+    with st.form("mc_form"):
+        m1, m2, m3, m4 = st.columns(4)
+        with m1:
+            n_paths = st.selectbox("Caminos", [1_000, 10_000, 100_000, 1_000_000], index=1, format_func=lambda n: f"{n:,}")
+        with m2:
+            horizon = st.number_input("Trades por camino", min_value=10, max_value=5_000, value=min(250, max(10, len(df))), step=50)
+        with m3:
+            ruin = st.number_input("Ruina (pts de pérdida)", min_value=0.0, value=float(max(10, round(hist_dd * 1.5))), step=10.0,
+                                   help="Un camino se arruina si su equity llega a -este valor. 0 = no se calcula.")
+        with m4:
+            seed = st.number_input("Semilla", min_value=0, value=0, step=1)
+        if st.form_submit_button("Simular 🎲"):
+            st.session_state.mc_params = (int(n_paths), int(horizon), float(ruin), int(seed))
+    params = st.session_state.get("mc_params")
+    if not params:
+        st.caption(f"Remuestrea los {len(df)} trades del histórico (BE = 0) con reemplazo.")
+        return
+    prof = profile_start(user_id, "risk")
+    with st.spinner("Simulando…"):
+        res = monte_carlo(user_id, ver, *params, _pts=df["pts"].to_numpy(dtype="float64"))
+    profile_lap(prof, "metrics", params[0] * params[1])
+    c1, c2, c3 = st.columns(3)
+    with c1: st.metric("Equity final media", f"{res['mean_final']:.1f}")
+    with c2: st.metric("Mediana max DD", f"{res['bands'].loc['P50', 'Max drawdown']:.1f}")
+    with c3: st.metric("Riesgo de ruina", f"{res['ruin']*100:.2f}%" if params[2] > 0 else "—")
+    st.dataframe(res["bands"].round(1), use_container_width=True)
+    chart = alt.Chart(res["hist"]).mark_bar().encode(
+        x=alt.X("desde:Q", bin="binned", title="Equity final (pts)"),
+        x2="hasta:Q",
+        y=alt.Y("caminos:Q", title="Caminos"),
+    ).properties(height=260)
+    st.altair_chart(chart, use_container_width=True)
+    st.caption(f"{params[0]:,} caminos de {params[1]} trades · histórico máx. DD {hist_dd} pts")
+    profile_lap(prof, "charts", len(res["hist"]))
+    profile_finish(prof)
+
+
+def parsed_upload(user_id: str, upload) -> tuple[pd.DataFrame, int]:
+    """build_import_rows del archivo subido, memorizado en la sesión por file_id:
+    los reruns del fragmento no vuelven a leerlo ni a parsearlo (tampoco si falló)."""
+    key = (user_id, upload.file_id)
+    memo = st.session_state.get("import_memo")
+    if memo is None or memo[0] != key:
+        try:
+            out = build_import_rows(user_id, read_journal_file(upload))
+        except Exception as e:
+            out = e
+        memo = (key, out)
+        st.session_state.import_memo = memo
+    if isinstance(memo[1], Exception):
+        raise memo[1]
+    return memo[1]
+
+
+@st.fragment
+def import_view(user_id: str):
+    st.subheader("Importar histórico")
+    st.caption("CSV o Excel con columnas **fecha**, **semana**, **dia**, **trade** (trades separados con '~'). "
+               "Puedes reimportar el mismo archivo: las filas ya cargadas se ignoran.")
+    upload = st.file_uploader("Archivo", type=["csv", "xlsx", "xls"])
+    if upload is not None:
+        try:
+            rows, rejected = parsed_upload(user_id, upload)
+        except ImportError:
+            st.error("Para leer Excel instala openpyxl (.xlsx) o xlrd (.xls), o exporta a CSV.")
+        except Exception as e:
+            st.error(f"No se pudo leer el archivo: {e}")
+        else:
+            st.write(f"**{len(rows)}** trades listos para importar" + (f" · {rejected} filas con fecha inválida" if rejected else ""))
+            if not rows.empty and st.button("Importar ✅", disabled=trades_offline(user_id)):
+                bar = st.progress(0.0)
+                res = import_trade_rows(user_id, rows, on_progress=bar.progress)
+                bump_trades_version(user_id)
+                if res["failed"]:
+                    flash("error", f"{len(res['failed'])} lotes fallaron (vuelve a importar para reintentar): {res['failed'][0]}")
+                else:
+                    flash("success", f"Importación completa ({res['sent']} filas enviadas).")
+                st.rerun()
 
-    st.markdown("---")
 
- 
-  
+def app_view():
+    user = st.session_state.auth.get("user")
+    if not user:
+        st.error("Sesión inválida."); do_sign_out(); st.stop()
+
+    # Token de la sesión para RLS (viaja en cada petición, no en el cliente compartido)
+    bind_session(user.id, st.session_state.auth.get("access_token"))
+    prof = profile_start(user.id)
+
+    st.sidebar.write(f"👤 Usuario: **{user.email}**")
+    if st.sidebar.button("Cerrar sesión"):
+        do_sign_out(); st.rerun()
+    if st.sidebar.button("🔄 Sincronizar todo", help="Recarga completa del histórico (ediciones y borrados)"):
+        request_full_reconcile(user.id)
+    fetch_trades(user.id, trades_version(user.id))  # sondeo antes de leer la versión: puede subirla
+    ver = trades_version(user.id)  # cambia solo cuando este usuario escribe o sincroniza
+
+    st.title("📊 Trading Journal Pro — Supabase")
+    if "flash" in st.session_state:
+        kind, msg = st.session_state.pop("flash")
+        (st.success if kind == "success" else st.error)(msg)
+    rejected = take_rejected_writes(user.id)
+    if rejected:
+        st.error(f"Supabase rechazó {rejected[0]} legs y no se guardaron (vuelve a cargarlos): {rejected[1]}")
+
+    month_view(user.id)
+
+    # Histórico completo (ya sincronizado por el calendario) para el aviso offline
+    df = session_trades(user.id, ver)
+    profile_lap(prof, "fetch", len(df), _frame_bytes(df))
+    if trades_offline(user.id):
+        st.warning("Sin conexión con Supabase: se muestra la copia local (solo lectura). Se reintenta automáticamente.")
+
+    global_view(user.id)
+
+    st.markdown("---")
 
     # Tabs
-    tab1, tab2, tab3 = st.tabs(["📋 Histórico", "➕ Agregar Trade", "🗓️ Resumen por Meses"]) 
+    tab1, tab2, tab3, tab4, tab5, tab6 = st.tabs(["📋 Histórico", "➕ Agregar Trade", "🗓️ Resumen por Meses", "🧮 Por símbolo / día", "🎲 Riesgo", "📥 Importar"]) 
 
     with tab1:
-        st.subheader("Histórico (filtrable)")
-        if df.empty:
-            st.info("No hay datos.")
-        else:
-            st.dataframe(df.sort_values("fecha", ascending=False), use_container_width=True)
-            csv_bytes = df.to_csv(index=False).encode()
-            st.download_button("Descargar CSV", csv_bytes, file_name="journal.csv", mime="text/csv")
-
+        history_view(user.id)
     with tab2:
-        st.subheader("Agregar Nueva Entrada")
-        with st.form("new_entry", clear_on_submit=True):
-            c1,c2,c3 = st.columns(3)
-            with c1:
-                f_fecha = st.date_input("Fecha", value=date.today())
-            with c2:
-                semana_numero = datetime.combine(f_fecha, datetime.min.time()).isocalendar()[1]
-                f_semana = st.text_input("Semana", value=f"Semana {semana_numero}")
-            with c3:
-                dia_txt = ES_DAYS[datetime.combine(f_fecha, datetime.min.time()).weekday()]
-                f_dia = st.text_input("Día", value=dia_txt)
-            f_trade = st.text_area("Trade(s)", placeholder="Ej: NQ:+50P ~ ES:-20P ~ NQ:BE", help="Separa con '~'. Usa 'BE' para Break Even.")
-            submitted = st.form_submit_button("Guardar ✅")
-            if submitted:
-                if not f_trade.strip():
-                    st.error("Ingresa al menos un trade.")
-                else:
-                    try:
-                        insert_trade_entries(user.id, f_fecha, f_semana, f_dia, f_trade)
-                        st.success("Guardado. Si no ves cambios, usa Rerun en el menú.")
-                        st.cache_data.clear()
-                    except Exception as e:
-                        st.error(f"Error guardando: {e}")
-
+        entry_view(user.id)
     with tab3:
-        st.subheader("Resultados por Mes")
-        if df.empty:
-            st.info("No hay datos para resumir.")
-        else:
-            df_monthly = pd.DataFrame({
-                "year": pd.to_datetime(df["fecha"]).dt.year,
-                "month": pd.to_datetime(df["fecha"]).dt.month,
-                "pts": df.apply(lambda r: _safe_pts(r, "point"), axis=1)
-# o:
-# "pts": df.apply(lambda r: _safe_pts(r, "porcentaje"), axis=1)
-
-            })
-            monthly = df_monthly.groupby(["year","month"]).agg(total_pts=("pts","sum"), trades=("pts","count")).reset_index()
-            monthly["Periodo"] = monthly.apply(lambda r: f"{MONTHS[int(r['month'])-1]} {int(r['year'])}", axis=1)
-            monthly = monthly.sort_values(["year","month"]) 
-            st.dataframe(monthly[["Periodo","total_pts","trades"]].rename(columns={"total_pts":"porcentaje","trades":"#Trades"}), use_container_width=True)
+        summary_view(user.id)
+        heatmap_view(user.id)
+    with tab4:
+        breakdown_view(user.id)
+    with tab5:
+        risk_view(user.id)
+    with tab6:
+        import_view(user.id)
+
+    profile_lap(prof, "views")
+    profile_finish(prof)
 
 # =========================
 # 🚦 Router
@@ -0,0 +1,733 @@
+"""Núcleo del journal sin Streamlit ni Supabase: parsing de trades, histórico tipado,
+lectura de archivos, resúmenes, calendario y métricas.
+
+Importarlo no tiene efectos (ni secrets, ni clientes, ni page config): lo usan journal.py
+y journal_report.py. pyarrow y openpyxl/xlrd solo se cargan al leer Parquet o Excel."""
+import calendar as _pycal
+import hashlib
+import math
+import re
+from concurrent.futures import Executor
+from datetime import date
+from fractions import Fraction
+from itertools import repeat
+
+import numpy as np
+import pandas as pd
+
+
+# =========================
+# 🧩 Parsing de trades
+# Soporta: "NQ:+50P", "ES:-20P", "BE", "+30P", "-10P" y múltiples con '~'
+# =========================
+TRADE_PATTERN = re.compile(r"^(?:(?P<sym>[A-Za-z0-9_]+):)?(?P<body>(?P<signed>[+-]?\d+)P|BE)$")
+ES_DAYS = {0:"Lunes",1:"Martes",2:"Miércoles",3:"Jueves",4:"Viernes",5:"Sábado",6:"Domingo"}
+MONTHS_ES = ["Enero","Febrero","Marzo","Abril","Mayo","Junio","Julio","Agosto","Septiembre","Octubre","Noviembre","Diciembre"]
+WEEKDAYS_SHORT = ["DOM","LUN","MAR","MIE","JUE","VIE","SAB"]  # columnas del calendario (domingo primero)
+
+
+SKIP_LEGS = {"None","nan","error","-error",""}
+
+
+def _parse_leg(it: str) -> tuple:
+    """(symbol, porcentaje, is_be) de una pierna; lo que no encaja cuenta como 0 sin símbolo."""
+    m = TRADE_PATTERN.match(it)
+    if not m:
+        return None, 0, False
+    sym, signed = m.group("sym", "signed")
+    return (sym, int(signed), False) if signed is not None else (sym, 0, True)
+
+
+def parse_trades_cell(cell: str):
+    if cell is None:
+        return []
+    parsed = []
+    for it in str(cell).split("~"):
+        it = it.strip()
+        if it in SKIP_LEGS:
+            continue
+        sym, pts, is_be = _parse_leg(it)
+        parsed.append({"symbol": sym, "porcentaje": pts, "is_be": is_be, "raw": it})
+    return parsed
+
+def parse_trades_frame(cells: pd.Series) -> pd.DataFrame:
+    """parse_trades_cell para una columna entera, como un solo DataFrame.
+    Devuelve una fila por pierna (symbol, porcentaje, is_be, raw, leg) con el índice
+    de la celda de origen; `leg` es la posición de la pierna dentro de la celda.
+    Las piernas se repiten mucho (símbolo x puntos), así que cada texto distinto se
+    parsea una sola vez; str.extract sobre todas era más lento que el bucle por celda."""
+    cells = cells.dropna()
+    idx, raws, legs = [], [], []
+    for i, cell in zip(cells.index, cells.astype(str).to_numpy()):
+        leg = 0
+        for it in cell.split("~"):
+            it = it.strip()
+            if it in SKIP_LEGS:
+                continue
+            idx.append(i); raws.append(it); legs.append(leg)
+            leg += 1
+    seen = {}
+    out = [seen[it] if it in seen else seen.setdefault(it, _parse_leg(it)) for it in raws]
+    syms, pts, be = zip(*out) if out else ((), (), ())
+    index = pd.Index(idx, dtype=cells.index.dtype) if idx else cells.index[:0]
+    return pd.DataFrame({
+        "symbol": pd.Series(syms, index=index, dtype=object),
+        "porcentaje": np.array(pts, dtype=int),
+        "is_be": np.array(be, dtype=bool),
+        "raw": pd.Series(raws, index=index, dtype=object),
+        "leg": np.array(legs, dtype="int64"),
+    }, index=index)
+
+
+def _safe_pts(row, colname="point"):
+    """Devuelve puntos/porcentaje como float.
+    Soporta None, '', 'nan', '2.5', '2.5%', etc. y respeta BE."""
+    if bool(row.get("be", False)):
+        return 0.0
+    v = row.get(colname, 0)
+    if v is None:
+        return 0.0
+    if isinstance(v, str):
+        v = v.strip()
+        if v.endswith("%"):
+            v = v[:-1]  # quita el símbolo
+        if v == "" or v.lower() in {"nan", "none"}:
+            return 0.0
+    try:
+        return float(v)
+    except Exception:
+        return 0.0
+
+
+def _normalize_pts(df: pd.DataFrame, colname="point") -> pd.Series:
+    """Versión vectorizada de _safe_pts para un DataFrame completo.
+    Mismas reglas (BE, None, '', 'nan', '2.5%', ...) pero sin apply por fila.
+    Los nulos numéricos (NaN) también cuentan como 0."""
+    if df.empty or colname not in df.columns:
+        return pd.Series(0.0, index=df.index, dtype="float64")
+    v = df[colname]
+    if not pd.api.types.is_numeric_dtype(v):
+        v = v.astype("string").str.strip().str.removesuffix("%").str.strip()
+        v = v.where(~v.str.lower().isin(["", "nan", "none"]))
+    pts = pd.to_numeric(v, errors="coerce").astype("Float64").fillna(0.0).astype("float64")
+    if "be" in df.columns:
+        pts = pts.mask(df["be"].astype(bool), 0.0)
+    return pts
+
+
+# =========================
+# 🗄️ Histórico tipado (mismo frame para Supabase, caché en disco y archivos)
+# =========================
+TRADE_COLUMNS = ["id","User_id","fecha","semana","dia","symbol","point","be","trade","created_at"]
+TRADE_SELECT = 'id,"User_id",fecha,semana,dia,symbol,point,be,trade,created_at'
+SUMMARY_COLUMNS = ["symbol", "pts", "trades"]
+
+
+def _trades_frame(rows) -> pd.DataFrame:
+    """Filas crudas de Supabase -> DataFrame tipado con 'pts' normalizado."""
+    df = pd.DataFrame(rows)
+    if df.empty:
+        return pd.DataFrame(columns=TRADE_COLUMNS + ["pts", "fecha_dt"])
+    # datetime64 una sola vez; el frame queda ordenado por él (índice por mes en month_slice)
+    df["fecha_dt"] = pd.to_datetime(df["fecha"], errors="coerce")
+    # Puntos normalizados una sola vez; todas las vistas reutilizan df["pts"]
+    df["pts"] = _normalize_pts(df, "point")
+    return _compact_frame(df.sort_values("fecha_dt", kind="stable", ignore_index=True))
+
+
+# Textos que se repiten entre filas: se guardan una vez por valor (category)
+COMPACT_CATEGORIES = ["User_id", "semana", "dia", "symbol", "point", "trade"]
+
+
+def _compact_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Esquema compacto del snapshot (idempotente; se aplica también tras concatenar o leer de disco):
+    - User_id, semana, dia, symbol y trade como category: el texto de cada entrada se guarda
+      una sola vez aunque la entrada tenga varios legs.
+    - point como category de texto ('10', '2.5%'); el valor numérico ya está en pts.
+    - id como int32 mientras quepa; created_at como datetime64 UTC.
+    - fecha como objetos date compartidos por día (fecha_dt es la columna datetime64)."""
+    if df.empty:
+        return df
+    cols = {}
+    for c in COMPACT_CATEGORIES:
+        if c in df.columns and not isinstance(df[c].dtype, pd.CategoricalDtype):
+            col = df[c].astype("string") if c == "point" else df[c]
+            cols[c] = col.astype("category")
+    if "created_at" in df.columns and not pd.api.types.is_datetime64_any_dtype(df["created_at"]):
+        cols["created_at"] = pd.to_datetime(df["created_at"], utc=True, errors="coerce", format="ISO8601")
+    if "be" in df.columns and df["be"].dtype == object and df["be"].notna().all():
+        cols["be"] = df["be"].astype(bool)
+    if "id" in df.columns and df["id"].dtype == "int64" and df["id"].max() < 2**31:
+        cols["id"] = df["id"].astype("int32")
+    codes, days = pd.factorize(df["fecha_dt"])
+    cols["fecha"] = np.append(pd.Series(days).dt.date.to_numpy(dtype=object), pd.NaT)[codes]  # -1 (NaT) -> NaT
+    return df.assign(**cols)
+
+
+# =========================
+# 📥 Archivos (CSV / Excel del journal, export CSV / Parquet)
+# =========================
+def read_journal_file(upload) -> pd.DataFrame:
+    """Lee un CSV/Excel del journal; las columnas se buscan sin distinguir mayúsculas.
+    CSV: primero con coma y el motor C; solo si falla se detecta el separador (motor python, ~4x más lento)."""
+    name = getattr(upload, "name", str(upload)).lower()
+    if name.endswith((".xlsx", ".xls")):
+        raw = pd.read_excel(upload, dtype=str)  # .xlsx requiere openpyxl; .xls, xlrd
+    else:
+        try:
+            raw = pd.read_csv(upload, dtype=str)
+        except pd.errors.ParserError:
+            raw = None
+        if raw is None or not {"fecha", "trade"} <= {str(c).strip().lower() for c in raw.columns}:
+            if hasattr(upload, "seek"):
+                upload.seek(0)
+            raw = pd.read_csv(upload, dtype=str, sep=None, engine="python")  # ';' o tabulador
+    raw.columns = [str(c).strip().lower() for c in raw.columns]
+    if "fecha" not in raw.columns or "trade" not in raw.columns:
+        raise ValueError("El archivo debe tener al menos las columnas 'fecha' y 'trade'")
+    return raw
+
+
+def build_import_rows(user_id: str | None, raw: pd.DataFrame) -> tuple[pd.DataFrame, int]:
+    """Filas listas para insertar (una por pierna) y cantidad de filas rechazadas por fecha inválida.
+    import_key = hash(fecha, trade, ocurrencia de esa celda ese día, pierna): estable entre reintentos."""
+    fechas = pd.to_datetime(raw["fecha"], errors="coerce", format="ISO8601")
+    otras = fechas.isna() & raw["fecha"].notna()  # p.ej. 31/01/2024 desde Excel en español
+    fechas[otras] = pd.to_datetime(raw.loc[otras, "fecha"], errors="coerce", dayfirst=True, format="mixed")
+    ok = fechas.notna()
+    raw = raw.loc[ok].assign(fecha=fechas[ok].dt.date)
+    if raw.empty:
+        return pd.DataFrame(), int((~ok).sum())
+    fecha_dt = pd.to_datetime(raw["fecha"])
+    semana = raw["semana"] if "semana" in raw.columns else None
+    dia = raw["dia"] if "dia" in raw.columns else None
+    auto_semana = "Semana " + fecha_dt.dt.isocalendar().week.astype(str)
+    auto_dia = fecha_dt.dt.weekday.map(ES_DAYS)
+    raw = raw.assign(
+        semana=auto_semana if semana is None else semana.fillna(auto_semana),
+        dia=auto_dia if dia is None else dia.fillna(auto_dia),
+        trade=raw["trade"].fillna("").str.strip(),
+        occ=raw.groupby(["fecha", raw["trade"].fillna("").str.strip()]).cumcount(),
+    )
+
+    legs = parse_trades_frame(raw["trade"]).join(raw[["fecha","semana","dia","trade","occ"]])
+    key_src = legs["fecha"].astype(str) + "|" + legs["trade"] + "|" + legs["occ"].astype(str) + "|" + legs["leg"].astype(str)
+    rows = pd.DataFrame({
+        "User_id": user_id,
+        "fecha": legs["fecha"].astype(str),
+        "semana": legs["semana"],
+        "dia": legs["dia"],
+        "symbol": legs["symbol"],
+        "point": legs["porcentaje"].astype(int),
+        "be": legs["is_be"].astype(bool),
+        "trade": legs["trade"],
+        "import_key": [hashlib.sha1(k.encode()).hexdigest() for k in key_src],
+    })
+    return rows.reset_index(drop=True), int((~ok).sum())
+
+
+def load_trades_file(path) -> pd.DataFrame:
+    """Histórico desde un archivo, con el mismo esquema que _trades_frame:
+    - export de la app (CSV o Parquet con columna point; Parquet requiere pyarrow)
+    - journal (CSV/Excel con fecha y trade, como en la importación)."""
+    name = str(path).lower()
+    if name.endswith(".parquet"):
+        return _trades_frame(pd.read_parquet(path))
+    if name.endswith(".csv"):
+        with open(path, encoding="utf-8-sig") as f:
+            exported = "point" in f.readline().strip().split(",")
+        if exported:
+            return _trades_frame(pd.read_csv(path))
+    rows, _ = build_import_rows(None, read_journal_file(path))
+    return _trades_frame(rows)
+
+
+# =========================
+# 🧮 Resúmenes y calendario
+# =========================
+def month_slice(df: pd.DataFrame, year: int, month: int) -> slice:
+    """Filas del mes como slice posicional: búsqueda binaria sobre fecha_dt ordenado."""
+    first = pd.Timestamp(year, month, 1)
+    lo, hi = df["fecha_dt"].searchsorted([first, first + pd.offsets.MonthBegin(1)])
+    return slice(int(lo), int(hi))
+
+
+def month_filter(df: pd.DataFrame, year: int, month: int) -> pd.DataFrame:
+    if "fecha_dt" in df.columns:
+        return df.iloc[month_slice(df, year, month)]
+    fechas = pd.to_datetime(df["fecha"])
+    return df[(fechas.dt.year == year) & (fechas.dt.month == month)].copy()
+
+
+def daily_summary(df_m: pd.DataFrame) -> pd.DataFrame:
+    """Fallback local de trades_daily: (day, symbol, pts, trades) del mes."""
+    if df_m.empty:
+        return pd.DataFrame(columns=["day"] + SUMMARY_COLUMNS)
+    day = df_m["fecha_dt"].dt.day.rename("day")
+    return (df_m.groupby([day, "symbol"], dropna=False, observed=True)["pts"]
+            .agg(pts="sum", trades="count").reset_index())
+
+
+def monthly_summary(df: pd.DataFrame) -> pd.DataFrame:
+    """Fallback local de trades_monthly: (year, month, symbol, pts, trades)."""
+    if df.empty:
+        return pd.DataFrame(columns=["year", "month"] + SUMMARY_COLUMNS)
+    fechas = df["fecha_dt"]
+    return (df.groupby([fechas.dt.year.rename("year"), fechas.dt.month.rename("month"), "symbol"], dropna=False, observed=True)["pts"]
+            .agg(pts="sum", trades="count").reset_index())
+
+
+def daily_totals(df: pd.DataFrame) -> pd.DataFrame:
+    """(fecha, pts, trades) de cada día con trades: un solo groupby sobre fecha_dt para todo el histórico."""
+    if df.empty:
+        return pd.DataFrame({"fecha": pd.Series(dtype="datetime64[ns]"), "pts": pd.Series(dtype="float64"),
+                             "trades": pd.Series(dtype="int64")})
+    return (df.groupby("fecha_dt", sort=False)["pts"].agg(pts="sum", trades="count")
+            .rename_axis("fecha").reset_index())
+
+
+def heatmap_frame(daily: pd.DataFrame) -> pd.DataFrame:
+    """daily_totals con su celda en la grilla anual, domingo primero como calendar_html:
+    year, week (columna 0..53 dentro del año) y dia (DOM..SAB)."""
+    f = daily["fecha"]
+    dow = ((f.dt.dayofweek + 1) % 7).to_numpy()
+    jan1 = (dow - (f.dt.dayofyear.to_numpy() - 1)) % 7  # día de la semana del 1 de enero
+    return daily.assign(year=f.dt.year, week=(f.dt.dayofyear.to_numpy() - 1 + jan1) // 7,
+                        dia=np.array(WEEKDAYS_SHORT)[dow])
+
+
+def filter_symbols(df: pd.DataFrame, sym_choice: list) -> pd.DataFrame:
+    """Deja los símbolos elegidos y las filas sin símbolo."""
+    if not sym_choice:
+        return df
+    return df[(df["symbol"].isin(sym_choice)) | (df["symbol"].isna())]
+
+
+# Estilos de calendar_html; la app los emite una vez por página y pide el HTML con css=False
+CALENDAR_CSS = """
+    <style>
+    .cal-wrap{width:100%;overflow-x:auto}
+    table.cal{width:100%;border-collapse:separate;border-spacing:10px;}
+    .cal thead th{
+      background: linear-gradient(135deg,#5662D6,#6C49B8);
+      color:#fff;text-align:center;padding:14px;border-radius:12px;
+      font-weight:800;letter-spacing:.03em
+    }
+    .cal td{
+      background:#101317;border-radius:14px;vertical-align:top;
+      height:120px;padding:10px 10px; position:relative;
+      box-shadow: inset 0 0 0 1px rgba(255,255,255,.04);
+    }
+    .cal .day-badge{
+      position:absolute;top:8px;left:10px;
+      width:28px;height:28px;border-radius:50%;
+      display:flex;align-items:center;justify-content:center;
+      font-weight:700;background:#0f172a;color:#e2e8f0;border:1px solid rgba(255,255,255,.05)
+    }
+    .cal .value{
+      margin-top:34px;text-align:center;font-weight:800;font-size:22px;
+      line-height:1;color:#e2e8f0;text-shadow:0 1px 0 rgba(0,0,0,.25)
+    }
+    .cal .pill{
+      margin:8px auto 0 auto;display:inline-block;min-width:84px;text-align:center;
+      padding:6px 10px;border-radius:999px;font-size:12px;
+      background:rgba(255,255,255,.06);color:#cbd5e1;border:1px solid rgba(255,255,255,.07)
+    }
+    .cal .muted{opacity:.35}
+    </style>
+    """
+
+
+def calendar_html(year: int, month: int, daily_points: dict[int, float], daily_counts: dict[int, int] | None = None,
+                  css: bool = True) -> str:
+    """
+    daily_points: {dia -> suma_de_puntos_o_%}
+    daily_counts: {dia -> cantidad_de_trades} (opcional)
+    css: incluir CALENDAR_CSS (False si la página ya lo tiene)
+    """
+
+    # ===== helpers de color (verde para +, rojo para -) =====
+    vals = list(daily_points.values()) if daily_points else [0]
+    max_abs = max(1, max(abs(v) for v in vals))
+
+    def bg_for(v: float) -> str:
+        """Color de fondo según magnitud relativa."""
+        if v is None:
+            return "#101317"  # vacío
+        if v == 0:
+            return "#151A21"  # neutro
+        # intensidad 0..1
+        t = min(1.0, abs(v) / max_abs)
+        # color base
+        if v > 0:
+            # verdes
+            # mezclar #1C2B23 (oscuro) con #1F4630 (más brillante)
+            r1,g1,b1 = (0x1C, 0x2B, 0x23)
+            r2,g2,b2 = (0x1F, 0x46, 0x30)
+        else:
+            # rojos
+            r1,g1,b1 = (0x2B, 0x1C, 0x21)
+            r2,g2,b2 = (0x46, 0x1F, 0x2C)
+        r = int(r1 + (r2-r1)*t)
+        g = int(g1 + (g2-g1)*t)
+        b = int(b1 + (b2-b1)*t)
+        return f"rgb({r},{g},{b})"
+
+    def txt_for(v: float) -> str:
+        if v is None or v == 0:
+            return "#cbd5e1"  # gris claro
+        return "#6ee7b7" if v > 0 else "#fca5a5"  # verde/rojo claro
+
+
+    # ===== Cabecera y grilla =====
+    cal = _pycal.Calendar(firstweekday=6)  # Domingo
+    weeks = cal.monthdayscalendar(year, month)
+    header = "<tr>" + "".join(f"<th>{d}</th>" for d in WEEKDAYS_SHORT) + "</tr>"
+
+    body_rows = []
+    for week in weeks:
+        tds = []
+        for d in week:
+            if d == 0:
+                tds.append('<td class="muted"></td>')
+                continue
+
+            val = float(daily_points.get(d, 0)) if d in daily_points else 0.0
+            cnt = daily_counts.get(d, 0) if (daily_counts is not None) else None
+            bg = bg_for(val)
+            c  = txt_for(val)
+
+            # Formato del valor grande (usa % si lo tuyo ahora es porcentaje)
+            val_txt = f"{int(val)}"  # o f"{val:.1f}%" si quieres 1 decimal
+
+            pill_txt = f"{cnt} trade" + ("s" if (cnt or 0) != 1 else "") if cnt is not None else ""
+
+            tds.append(
+                f"""
+                <td style="background:{bg}">
+                  <div class="day-badge">{d}</div>
+                  <div class="value" style="color:{c}">{val_txt}</div>
+                  {f'<div class="pill">{pill_txt}</div>' if cnt is not None else ''}
+                </td>
+                """
+            )
+        body_rows.append("<tr>" + "".join(tds) + "</tr>")
+
+    html = f"""
+    <div class="cal-wrap">
+      {CALENDAR_CSS if css else ""}
+      <table class="cal">
+        <thead>{header}</thead>
+        <tbody>
+          {''.join(body_rows)}
+        </tbody>
+      </table>
+    </div>
+    """
+    return html
+
+
+# =========================
+# 📊 Métricas
+# =========================
+def compute_metrics(df_trades: pd.DataFrame):
+    if df_trades.empty:
+        return {
+            "equity_df": pd.DataFrame(),
+            "wins": 0, "loss": 0, "be_ct": 0,
+            "win_rate": 0.0, "avg_win": 0.0, "avg_loss": 0.0,
+            "profit_factor": np.nan, "expectancy": 0.0,
+            "max_dd": 0,
+        }
+
+    df = df_trades
+    if "pts" not in df.columns:
+        df = df.copy()
+        df["pts"] = _normalize_pts(df, "point")  # o "porcentaje" si renombraste
+
+    df = df.sort_values("fecha", kind="stable")
+
+    # Equity global
+    df_equity = df[["fecha","pts"]].copy()
+    df_equity["equity"] = df_equity["pts"].cumsum()
+
+    wins = (df["pts"] > 0).sum()
+    loss = (df["pts"] < 0).sum()
+    be_ct = (df.get("be", False) == True).sum()
+
+    # Suma exacta (independiente del orden) para que coincida con el acumulador incremental
+    sum_wins = math.fsum(df.loc[df["pts"] > 0, "pts"])
+    sum_loss = -math.fsum(df.loc[df["pts"] < 0, "pts"])
+
+    tot = wins + loss
+    win_rate = wins / tot if tot else 0.0
+    avg_win = (sum_wins / wins) if wins else 0.0
+    avg_loss = (sum_loss / loss) if loss else 0.0
+    profit_factor = (sum_wins / sum_loss) if sum_loss else np.inf
+    expectancy = (win_rate * avg_win) - ((1 - win_rate) * avg_loss)
+
+    roll_max = np.maximum.accumulate(df_equity["equity"].values)
+    drawdowns = roll_max - df_equity["equity"].values
+    max_dd = int(np.max(drawdowns)) if len(drawdowns) else 0
+
+    return {
+        "equity_df": df_equity,
+        "wins": int(wins), "loss": int(loss), "be_ct": int(be_ct),
+        "win_rate": float(win_rate), "avg_win": float(avg_win), "avg_loss": float(avg_loss),
+        "profit_factor": float(profit_factor) if np.isfinite(profit_factor) else np.inf,
+        "expectancy": float(expectancy),
+        "max_dd": int(max_dd),
+    }
+
+
+# =========================
+# ♻️ Métricas incrementales (mismo resultado que compute_metrics)
+# Estado por usuario en su snapshot; los trades nuevos se pliegan en O(k),
+# sin copiar ni hashear el DataFrame completo.
+# =========================
+def _exact_sum(values: pd.Series) -> Fraction:
+    """Suma exacta; hay pocos valores distintos, así que se agrupa por valor."""
+    counts = values.value_counts(sort=False)
+    return sum((Fraction(float(v)) * int(c) for v, c in counts.items()), Fraction(0))
+
+
+def _metrics_init() -> dict:
+    return {
+        "n": 0, "wins": 0, "loss": 0, "be_ct": 0,
+        "sum_wins": Fraction(0), "sum_loss": Fraction(0),
+        "equity": 0.0, "peak": -np.inf, "max_dd": 0.0,
+        "equity_parts": [],
+    }
+
+
+def _metrics_fold(acc: dict, chunk: pd.DataFrame) -> dict:
+    """Devuelve un estado nuevo con `chunk` (ya ordenado por fecha, al final del histórico) sumado."""
+    acc = {**acc, "equity_parts": list(acc["equity_parts"])}
+    if chunk.empty:
+        return acc
+    pts = chunk["pts"]
+    acc["n"] += len(chunk)
+    acc["wins"] += int((pts > 0).sum())
+    acc["loss"] += int((pts < 0).sum())
+    acc["be_ct"] += int((chunk.get("be", False) == True).sum())
+    acc["sum_wins"] += _exact_sum(pts[pts > 0])
+    acc["sum_loss"] -= _exact_sum(pts[pts < 0])
+
+    # Continúa la curva desde la cola: mismo cumsum / máximo acumulado que sobre el histórico entero
+    equity = np.cumsum(np.concatenate(([acc["equity"]], pts.to_numpy(dtype="float64"))))[1:]
+    roll_max = np.maximum.accumulate(np.concatenate(([acc["peak"]], equity)))[1:]
+    acc["equity"] = float(equity[-1])
+    acc["peak"] = float(roll_max[-1])
+    acc["max_dd"] = max(acc["max_dd"], float(np.max(roll_max - equity)))
+
+    part = chunk[["fecha","pts"]].copy()
+    part["equity"] = equity
+    acc["equity_parts"].append(part)
+    return acc
+
+
+def _metrics_build(df: pd.DataFrame) -> dict:
+    return _metrics_fold(_metrics_init(), df.sort_values("fecha", kind="stable"))
+
+
+def _metrics_result(acc: dict) -> dict:
+    """Mismo dict que compute_metrics a partir del estado acumulado."""
+    if acc["n"] == 0:
+        return compute_metrics(pd.DataFrame())
+    if len(acc["equity_parts"]) > 1:
+        acc["equity_parts"][:] = [pd.concat(acc["equity_parts"])]  # se materializa una sola vez
+    wins, loss = acc["wins"], acc["loss"]
+    sum_wins, sum_loss = float(acc["sum_wins"]), float(acc["sum_loss"])
+
+    tot = wins + loss
+    win_rate = wins / tot if tot else 0.0
+    avg_win = (sum_wins / wins) if wins else 0.0
+    avg_loss = (sum_loss / loss) if loss else 0.0
+    profit_factor = (sum_wins / sum_loss) if sum_loss else np.inf
+    expectancy = (win_rate * avg_win) - ((1 - win_rate) * avg_loss)
+
+    return {
+        "equity_df": acc["equity_parts"][0],
+        "wins": int(wins), "loss": int(loss), "be_ct": int(acc["be_ct"]),
+        "win_rate": float(win_rate), "avg_win": float(avg_win), "avg_loss": float(avg_loss),
+        "profit_factor": float(profit_factor) if np.isfinite(profit_factor) else np.inf,
+        "expectancy": float(expectancy),
+        "max_dd": int(acc["max_dd"]),
+    }
+
+
+# =========================
+# 🧮 Métricas por símbolo y por día de la semana
+# Mismas definiciones que compute_metrics, todos los grupos a la vez.
+# =========================
+BREAKDOWN_COLUMNS = ["trades", "wins", "loss", "be_ct", "win_rate", "avg_win", "avg_loss",
+                     "profit_factor", "expectancy", "pts", "max_dd"]
+NO_SYMBOL = "(sin símbolo)"
+
+
+def group_metrics(df: pd.DataFrame, key) -> pd.DataFrame:
+    """Métricas de compute_metrics por cada valor de `key` (alineada con df, ordenado por fecha).
+    Un solo factorize y agregaciones vectorizadas; el drawdown sale de cumsum y cummax
+    segmentados por grupo, sin bucles en Python."""
+    if df.empty:
+        return pd.DataFrame(columns=BREAKDOWN_COLUMNS)
+    codes, labels = pd.factorize(pd.Series(key, index=df.index), sort=True, use_na_sentinel=False)
+    pts = df["pts"].to_numpy(dtype="float64")
+    frame = pd.DataFrame({
+        "pts": pts,
+        "wins": pts > 0,
+        "loss": pts < 0,
+        "be_ct": (df["be"] == True).to_numpy() if "be" in df.columns else False,
+        "sum_wins": np.where(pts > 0, pts, 0.0),
+        "sum_loss": np.where(pts < 0, -pts, 0.0),
+    })
+    gb = frame.groupby(codes, sort=True)
+    out = gb.agg(trades=("pts", "size"), pts=("pts", "sum"), wins=("wins", "sum"), loss=("loss", "sum"),
+                 be_ct=("be_ct", "sum"), sum_wins=("sum_wins", "sum"), sum_loss=("sum_loss", "sum"))
+
+    # Equity y pico acumulado por grupo (en orden de fecha dentro de cada grupo)
+    equity = gb["pts"].cumsum()
+    out["max_dd"] = (equity.groupby(codes).cummax() - equity).groupby(codes).max().astype(int)
+
+    tot = out["wins"] + out["loss"]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        out["win_rate"] = np.where(tot > 0, out["wins"] / tot, 0.0)
+        out["avg_win"] = np.where(out["wins"] > 0, out["sum_wins"] / out["wins"], 0.0)
+        out["avg_loss"] = np.where(out["loss"] > 0, out["sum_loss"] / out["loss"], 0.0)
+        out["profit_factor"] = np.where(out["sum_loss"] > 0, out["sum_wins"] / out["sum_loss"], np.inf)
+    out["expectancy"] = out["win_rate"] * out["avg_win"] - (1 - out["win_rate"]) * out["avg_loss"]
+    out.index = pd.Index(labels[out.index], name=getattr(key, "name", None))
+    return out[BREAKDOWN_COLUMNS]
+
+
+def compute_breakdown(df: pd.DataFrame) -> dict:
+    """{"symbol": métricas por símbolo, "dia": por día de la semana (Lunes→Domingo)}.
+    El día sale de la fecha, no del texto libre de `dia`."""
+    if df.empty:
+        empty = group_metrics(df, [])
+        return {"symbol": empty, "dia": empty}
+    by_symbol = group_metrics(df, df["symbol"].astype(object).fillna(NO_SYMBOL).rename("symbol"))
+    by_day = group_metrics(df, df["fecha_dt"].dt.weekday.rename("dia"))
+    by_day.index = by_day.index.map(ES_DAYS)
+    return {"symbol": by_symbol, "dia": by_day}
+
+
+# =========================
+# 📈 Ventanas móviles, rachas y tiempo bajo el agua
+# Todo sale de sumas acumuladas sobre pts ordenado: O(n) sea cual sea la ventana.
+# =========================
+ROLLING_METRICS = {"win_rate": "Win Rate", "expectancy": "Expectancy", "profit_factor": "Profit Factor"}
+
+
+def rolling_metrics(df: pd.DataFrame, window: int, by: str = "trades") -> pd.DataFrame:
+    """Win rate, expectancy y profit factor de los últimos `window` trades (by="trades")
+    o días naturales (by="days") en cada trade. df ordenado por fecha_dt, con pts.
+    Cada ventana es la diferencia de dos sumas acumuladas, no se recalcula."""
+    if df.empty:
+        return pd.DataFrame(columns=["fecha"] + list(ROLLING_METRICS))
+    pts = df["pts"].to_numpy(dtype="float64")
+    n = len(pts)
+    # Sumas acumuladas con un 0 delante: suma de (lo, hi] = c[hi] - c[lo]
+    def cum(x):
+        return np.concatenate(([0], np.cumsum(x)))
+    c_wins, c_loss = cum(pts > 0), cum(pts < 0)
+    c_sw, c_sl = cum(np.where(pts > 0, pts, 0.0)), cum(np.where(pts < 0, -pts, 0.0))
+
+    hi = np.arange(1, n + 1)
+    if by == "days":
+        t = df["fecha_dt"].to_numpy()
+        lo = np.searchsorted(t, t - np.timedelta64(window, "D"), side="right")
+    else:
+        lo = np.maximum(hi - window, 0)
+    wins, loss = c_wins[hi] - c_wins[lo], c_loss[hi] - c_loss[lo]
+    sum_wins, sum_loss = c_sw[hi] - c_sw[lo], c_sl[hi] - c_sl[lo]
+
+    tot = wins + loss
+    with np.errstate(divide="ignore", invalid="ignore"):
+        win_rate = np.where(tot > 0, wins / tot, 0.0)
+        avg_win = np.where(wins > 0, sum_wins / wins, 0.0)
+        avg_loss = np.where(loss > 0, sum_loss / loss, 0.0)
+        profit_factor = np.where(sum_loss > 0, sum_wins / sum_loss, np.inf)
+    return pd.DataFrame({
+        "fecha": df["fecha"].to_numpy(),
+        "win_rate": win_rate,
+        "expectancy": win_rate * avg_win - (1 - win_rate) * avg_loss,
+        "profit_factor": profit_factor,
+    })
+
+
+def _runs(mask: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """(inicio, fin exclusivo) de cada tramo consecutivo de True."""
+    edges = np.diff(np.concatenate(([0], mask.astype(np.int8), [0])))
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
+
+def streak_metrics(df: pd.DataFrame) -> dict:
+    """Rachas máximas (un BE corta ambas) y tiempo bajo el agua de la curva de equity.
+    Bajo el agua = equity por debajo de su máximo previo; la duración en días se cuenta
+    desde la fecha del máximo hasta la del último trade del tramo (o hasta hoy si sigue abierto)."""
+    out = {"max_win_streak": 0, "max_loss_streak": 0, "underwater_pct": 0.0,
+           "underwater_max_trades": 0, "underwater_max_days": 0, "underwater_now_days": 0}
+    if df.empty:
+        return out
+    pts = df["pts"].to_numpy(dtype="float64")
+    for key, mask in (("max_win_streak", pts > 0), ("max_loss_streak", pts < 0)):
+        start, end = _runs(mask)
+        out[key] = int((end - start).max()) if len(start) else 0
+
+    equity = np.cumsum(pts)
+    under = equity < np.maximum.accumulate(equity)
+    start, end = _runs(under)
+    if len(start):
+        t = df["fecha_dt"].to_numpy()
+        # El máximo que abre cada tramo es el trade anterior a su inicio (start >= 1 siempre)
+        closed_at = t[end - 1]
+        open_now = end == len(pts)
+        closed_at = np.where(open_now, np.datetime64(date.today()), closed_at)
+        days = ((closed_at - t[start - 1]) // np.timedelta64(1, "D")).astype(int)
+        out.update(
+            underwater_pct=float(under.mean()),
+            underwater_max_trades=int((end - start).max()),
+            underwater_max_days=int(days.max()),
+            underwater_now_days=int(days[-1]) if open_now[-1] else 0,
+        )
+    return out
+
+
+# =========================
+# 🎲 Monte Carlo (bootstrap de pts)
+# Caminos generados por lotes de tamaño fijo: la memoria no depende del número de caminos.
+# =========================
+MC_CHUNK = 2_000_000                 # trades simulados por lote (~16 MB de float64)
+MC_PERCENTILES = [5, 25, 50, 75, 95]
+
+
+def _mc_chunk(pts: np.ndarray, paths: int, horizon: int, ruin: float, seed) -> tuple[np.ndarray, np.ndarray, int]:
+    """Un lote: (equity final, max drawdown) por camino y cuántos tocan -ruin.
+    Cada camino empieza en 0 y remuestrea `horizon` trades con reemplazo."""
+    rng = np.random.default_rng(seed)
+    equity = np.cumsum(pts[rng.integers(0, len(pts), size=(paths, horizon))], axis=1)
+    peak = np.maximum.accumulate(np.maximum(equity, 0.0), axis=1)  # el capital inicial cuenta como pico
+    max_dd = (peak - equity).max(axis=1)
+    ruined = int((equity.min(axis=1) <= -ruin).sum()) if ruin > 0 else 0
+    return equity[:, -1], max_dd, ruined
+
+
+def simulate_paths(pts: np.ndarray, n_paths: int, horizon: int, ruin: float, seed: int = 0,
+                   executor: Executor | None = None) -> dict:
+    """Bootstrap de n_paths curvas de `horizon` trades. Cada lote tiene su propia semilla
+    derivada de `seed`: el resultado no depende de cómo se repartan los lotes ni de si
+    corren en `executor` (p.ej. un ProcessPoolExecutor) o en este proceso."""
+    pts = np.asarray(pts, dtype="float64")
+    per_chunk = max(1, MC_CHUNK // horizon)
+    sizes = [min(per_chunk, n_paths - i) for i in range(0, n_paths, per_chunk)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    run = executor.map if executor is not None and len(sizes) > 1 else map
+    parts = list(run(_mc_chunk, repeat(pts), sizes, repeat(horizon), repeat(ruin), seeds))
+    final = np.concatenate([p[0] for p in parts])
+    max_dd = np.concatenate([p[1] for p in parts])
+    return {
+        "final": final,
+        "max_dd": max_dd,
+        "ruin": sum(p[2] for p in parts) / n_paths,
+    }
@@ -0,0 +1,136 @@
+"""Reportes por lotes del journal (p.ej. el nocturno desde cron), sin Streamlit.
+
+Por cada fuente: métricas globales, rachas / tiempo bajo el agua y resumen mensual,
+como una línea JSON.
+
+    python journal_report.py files exports/*.csv exports/*.parquet journal.xlsx
+    python journal_report.py users 3f1c0a… 9a2e7b… --out reportes.jsonl
+    cut -f1 usuarios.tsv | python journal_report.py users -
+
+Las fuentes se reparten en un pool de procesos (--workers, por defecto una por CPU).
+`users` lee public."Trades" con SUPABASE_URL y SUPABASE_SERVICE_KEY del entorno; la service
+key salta RLS, solo debe estar en la máquina del cron. Si alguna fuente falla, su línea
+lleva "error" y el proceso sale con código 1.
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timezone
+
+import journal_core as core
+
+PAGE_SIZE = 1000  # filas por página; no debe superar el max-rows de PostgREST
+
+_client = None
+
+
+def _supabase():
+    """Cliente del proceso, creado al primer uso: supabase solo se importa en modo users."""
+    global _client
+    if _client is None:
+        from supabase import create_client
+        _client = create_client(os.environ["SUPABASE_URL"], os.environ["SUPABASE_SERVICE_KEY"])
+    return _client
+
+
+def fetch_user_trades(user_id: str) -> list[dict]:
+    """Todas las filas del usuario, paginadas por id (keyset)."""
+    rows, last = [], None
+    while True:
+        q = _supabase().table("Trades").select(core.TRADE_SELECT).eq("User_id", user_id)
+        if last is not None:
+            q = q.gt("id", last)
+        page = q.order("id").limit(PAGE_SIZE).execute().data or []
+        rows += page
+        if len(page) < PAGE_SIZE:
+            return rows
+        last = page[-1]["id"]
+
+
+def trades_report(df) -> dict:
+    """Resumen de un histórico de core._trades_frame (mismas métricas que la app)."""
+    metrics = core.compute_metrics(df)
+    del metrics["equity_df"]
+    monthly = core.monthly_summary(df)
+    fechas = df["fecha_dt"].dropna()
+    return {
+        "trades": len(df),
+        "desde": fechas.min().date().isoformat() if len(fechas) else None,
+        "hasta": fechas.max().date().isoformat() if len(fechas) else None,
+        "pts": float(df["pts"].sum()) if len(df) else 0.0,
+        **metrics,
+        **core.streak_metrics(df),
+        "monthly": monthly.astype(object).where(monthly.notna(), None).to_dict("records"),
+    }
+
+
+def report_source(kind: str, source: str) -> dict:
+    """Carga y resume una fuente; corre dentro de un proceso del pool."""
+    t0 = time.perf_counter()
+    try:
+        if kind == "files":
+            df = core.load_trades_file(source)
+        else:
+            df = core._trades_frame(fetch_user_trades(source))
+        out = {"source": source, **trades_report(df)}
+    except Exception as e:
+        out = {"source": source, "error": f"{type(e).__name__}: {e}"}
+    out["seconds"] = round(time.perf_counter() - t0, 3)
+    return out
+
+
+def _jsonable(v):
+    """inf/NaN (p.ej. profit factor sin pérdidas) -> null y escalares numpy -> Python."""
+    if isinstance(v, dict):
+        return {k: _jsonable(x) for k, x in v.items()}
+    if isinstance(v, list):
+        return [_jsonable(x) for x in v]
+    if hasattr(v, "item"):
+        v = v.item()
+    if isinstance(v, float) and not math.isfinite(v):
+        return None
+    return v
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="Métricas y resúmenes mensuales del journal por lotes.")
+    ap.add_argument("kind", choices=["files", "users"], help="archivos exportados/journal o user_id de Supabase")
+    ap.add_argument("sources", nargs="+", help="rutas o user_id; '-' los lee de stdin, uno por línea")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="procesos del pool")
+    ap.add_argument("--out", help="jsonl al que se añaden los reportes (por defecto stdout)")
+    args = ap.parse_args(argv)
+
+    sources = [s.strip() for arg in args.sources for s in (sys.stdin if arg == "-" else [arg]) if s.strip()]
+    if args.kind == "users" and not (os.environ.get("SUPABASE_URL") and os.environ.get("SUPABASE_SERVICE_KEY")):
+        ap.error("users requiere SUPABASE_URL y SUPABASE_SERVICE_KEY en el entorno")
+
+    run_at = datetime.now(timezone.utc).isoformat(timespec="seconds")
+    out = open(args.out, "a", encoding="utf-8") if args.out else sys.stdout
+    failed = 0
+    try:
+        workers = min(args.workers, len(sources))
+        if workers <= 1:
+            results = (report_source(args.kind, s) for s in sources)
+        else:
+            pool = ProcessPoolExecutor(workers)
+            results = (f.result() for f in as_completed([pool.submit(report_source, args.kind, s) for s in sources]))
+        for rec in results:
+            failed += "error" in rec
+            out.write(json.dumps(_jsonable({"run_at": run_at, **rec}), ensure_ascii=False) + "\n")
+            out.flush()
+    finally:
+        if workers > 1:
+            pool.shutdown()
+        if out is not sys.stdout:
+            out.close()
+    if failed:
+        print(f"{failed} de {len(sources)} fuentes con error", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
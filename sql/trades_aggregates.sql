@@ -0,0 +1,53 @@
+-- =========================
+-- 📊 Agregados de "Trades" para el calendario y el resumen por meses
+-- Ejecutar una vez en el SQL Editor de Supabase.
+-- security_invoker = true -> las vistas respetan el RLS de public."Trades".
+-- =========================
+
+-- Puntos normalizados igual que _normalize_pts en journal.py:
+-- BE -> 0; None / '' / 'nan' / texto inválido -> 0; '2.5%' -> 2.5
+create or replace function public.trade_pts(p_point text, p_be boolean)
+returns double precision
+language sql
+immutable
+as $$
+  select case
+    when coalesce(p_be, false) then 0
+    else coalesce(
+      (select case
+         when v ~ '^[+-]?([0-9]+\.?[0-9]*|\.[0-9]+)([eE][+-]?[0-9]+)?$' then v::double precision
+       end
+       from (select btrim(regexp_replace(btrim(p_point), '%$', '')) as v) s),
+      0)
+  end
+$$;
+
+-- Suma y cantidad por día y símbolo (el calendario filtra símbolos y suma por día)
+create or replace view public.trades_daily
+with (security_invoker = true) as
+select
+  "User_id",
+  fecha::date                              as fecha,
+  extract(year  from fecha::date)::int     as year,
+  extract(month from fecha::date)::int     as month,
+  extract(day   from fecha::date)::int     as day,
+  symbol,
+  sum(public.trade_pts(point::text, be))   as pts,
+  count(*)                                 as trades
+from public."Trades"
+group by "User_id", fecha::date, symbol;
+
+-- Suma y cantidad por mes y símbolo (años, símbolos y pestaña "Resumen por Meses")
+create or replace view public.trades_monthly
+with (security_invoker = true) as
+select
+  "User_id",
+  extract(year  from fecha::date)::int     as year,
+  extract(month from fecha::date)::int     as month,
+  symbol,
+  sum(public.trade_pts(point::text, be))   as pts,
+  count(*)                                 as trades
+from public."Trades"
+group by "User_id", extract(year from fecha::date), extract(month from fecha::date), symbol;
+
+grant select on public.trades_daily, public.trades_monthly to authenticated;
@@ -0,0 +1,11 @@
+-- =========================
+-- 📥 Clave de importación para el importador masivo
+-- Cada pierna importada lleva un import_key determinista; reimportar el mismo
+-- archivo (o retomar uno interrumpido) no duplica filas.
+-- Las altas del formulario llevan un import_key aleatorio: reenviar un lote no las duplica.
+-- Sin esta migración el formulario hace insert simple (sin esa garantía).
+-- =========================
+alter table public."Trades" add column if not exists import_key text;
+
+create unique index if not exists trades_user_import_key
+  on public."Trades" ("User_id", import_key);
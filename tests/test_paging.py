@@ -0,0 +1,78 @@
+"""Paginación keyset del DAO contra el stub de bench/ con el max-rows de PostgREST (1000).
+
+    python -m pytest -q tests
+"""
+import os
+import sys
+from datetime import date, timedelta
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "bench"))
+
+from journal_bench import USER_ID, StubTable, load_journal  # noqa: E402
+
+SIZES = [0, 999, 1000, 1001, 5000]
+
+
+@pytest.fixture(scope="module")
+def journal(tmp_path_factory):
+    """Globales de journal.py cargado una vez en modo bare (load_journal cambia el cwd)."""
+    cwd = os.getcwd()
+    try:
+        yield load_journal(tmp_path_factory.mktemp("journal"))
+    finally:
+        os.chdir(cwd)
+
+
+def make_rows(n: int, same_day: int = 0) -> list[dict]:
+    """n filas repartidas en ~3 por día; las `same_day` primeras caen en una sola fecha.
+    Los ids no siguen el orden de fecha, para que el orden (fecha, id) no salga gratis."""
+    start = date(2020, 1, 1)
+    rows = []
+    for i in range(n):
+        day = start if i < same_day else start + timedelta(days=(i * 7919) % max(1, n // 3))
+        rows.append({
+            "id": (i * 7919) % 100_003 + 1,
+            "User_id": USER_ID,
+            "fecha": day.isoformat(),
+            "symbol": "NQ",
+            "point": 10,
+            "be": False,
+            "trade": "NQ:+10P",
+            "created_at": "2020-01-01T00:00:00+00:00" if i < same_day else f"{day.isoformat()}T12:00:00+00:00",
+        })
+    return rows
+
+
+def assert_pages(got: list[dict], rows: list[dict], col: str):
+    ids = [r["id"] for r in got]
+    assert len(ids) == len(set(ids)), "filas repetidas entre páginas"
+    assert set(ids) == {r["id"] for r in rows}, "faltan filas"
+    keys = [(r[col], r["id"]) for r in got]
+    assert keys == sorted(keys), f"fuera de orden ({col}, id)"
+
+
+@pytest.mark.parametrize("n", SIZES)
+@pytest.mark.parametrize("same_day", [0, 2500])
+def test_fetch_all_rows(journal, n, same_day):
+    rows = make_rows(n, min(same_day, n))
+    journal["_table"] = StubTable(rows)
+    assert_pages(journal["_fetch_all_rows"](USER_ID), rows, "fecha")
+
+
+@pytest.mark.parametrize("n", SIZES)
+def test_fetch_range_created_at(journal, n):
+    """Delta de sync_trades: todo lo posterior a la marca de agua, por (created_at, id)."""
+    rows = make_rows(n, same_day=n // 2)
+    journal["_table"] = StubTable(rows)
+    pages = journal["_fetch_range"](USER_ID, "created_at")
+    assert all(len(p) <= 1000 for p in pages)
+    assert_pages([r for p in pages for r in p], rows, "created_at")
+
+    if n:
+        mark = sorted((r["created_at"], r["id"]) for r in rows)[n // 3]
+        pages = journal["_fetch_range"](USER_ID, "created_at", after=mark)
+        assert_pages([r for p in pages for r in p], [r for r in rows if (r["created_at"], r["id"]) > mark], "created_at")